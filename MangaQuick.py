@@ -2,31 +2,30 @@
 import os
 import sys
 import time
-import shutil
 import json
 
 # Third-party library imports
 import streamlit as st
 import torch
-from fastai.vision import load_learner
 from fastai.vision import *
 from PIL import Image
-import deepl
 from dotenv import load_dotenv
-from ruamel.yaml import YAML
 from streamlit_drawable_canvas import st_canvas
-from manga_ocr import MangaOcr
-import easyocr
 
 # Custom module imports for various components of the comic translation app
-from components.text_detection.text_segmentation import text_segmentation
+from components.text_detection.text_segmentation import text_segmentation_batch
 from components.text_block_detection import block_detection, blocks_to_json, modify_mask
-from components.text_recognition import ocr
+from components.text_recognition import ocr_batch
 from components.text_translation import translate_texts
-from components.image_inpainting.inpainting import inpainting
-from components.text_injection import text_injection
-from components.cust_translators.ollama import OllamaTranslator
-from components.cust_translators.googletrans import GoogleTrans
+from components.image_inpainting.inpainting import EXPORTED_MODEL_EXTENSIONS, inpainting
+from components.text_injection import text_injection_parallel
+from components import pipeline, profiling
+from components.page import Page, deduplicate_pages, encode_png
+from components.export import PageArchive
+from components.workspace import Workspace
+from components.quantization import PRECISIONS
+from components.translation_cache import TranslationCache
+from components.ocr_cache import OcrCache
 from utils.utils import *
 
 # import paddleocr
@@ -66,20 +65,26 @@ if 'current_file_index' not in st.session_state:
 if 'download' not in st.session_state:
     st.session_state['download'] = False
 
-# Initialize the list of text blocks, canvas rectangles, texts, and translated texts
-if 'blocks' not in st.session_state:
-    st.session_state['blocks'] = []
-
-if 'texts' not in st.session_state:
-    st.session_state['texts'] = []
-
-if 'text_translated' not in st.session_state:
-    st.session_state['text_translated'] = []
+# Initialize the list of pages, each one carrying its image, mask, blocks, texts and translations
+if 'pages' not in st.session_state:
+    st.session_state['pages'] = []
 
 # Timer
 if 'start_time' not in st.session_state:
     st.session_state['start_time'] = 0
 
+# Private directory of the session, so concurrent sessions never share files
+if 'workspace' not in st.session_state:
+    st.session_state['workspace'] = Workspace()
+
+# Archive of the translated pages of the last run
+if 'archive' not in st.session_state:
+    st.session_state['archive'] = None
+
+# Profiler of the current run, None when profiling is disabled
+if 'profiler' not in st.session_state:
+    st.session_state['profiler'] = None
+
 # Sidebar
 ##############################################################
 
@@ -129,6 +134,10 @@ with st.sidebar:
     with st.expander("Text segmentation", expanded=True):
         model_name = st.selectbox('Model', model_names, 0)
         segmentation_device = st.selectbox('Segmentation device', ('cuda', 'cpu'), 0)
+        segmentation_precision = st.selectbox('Segmentation CPU precision', PRECISIONS, 0, disabled=segmentation_device != 'cpu')
+        segmentation_batch_size = st.number_input('Segmentation batch size', value=4, min_value=1, step=1)
+        tile_size = st.number_input('Tile size (0 = whole page)', value=0, min_value=0, step=256)
+        tile_overlap = st.number_input('Tile overlap', value=128, min_value=0, step=16)
 
     # Text block detection settings
     with st.expander("Text block detection", expanded=False):
@@ -140,6 +149,10 @@ with st.sidebar:
     # Device selection for OCR
     ocr_device = st.selectbox('OCR device', ('cuda', 'cpu'), 0)
     ocr_type = st.selectbox('OCR', ('manga_ocr', 'easyocr'), 0)#, 'PaddleOCR' ), 0)
+    ocr_batch_size = st.number_input('OCR batch size', value=16, min_value=1, step=1)
+    ocr_pages_per_step = st.number_input('OCR pages per step', value=4, min_value=1, step=1,
+                                         help='Pages whose text blocks are recognized together, filling the OCR batches')
+    use_ocr_cache = st.checkbox('Reuse previous OCR results', True)
 
     if ocr_type == 'easyocr':
         ocr_lang_input = st.text_input('Enter source languages (comma separated)', 'en, ja') 
@@ -172,18 +185,39 @@ with st.sidebar:
             pass
             
         target_language = st.selectbox('Target language', languages.keys(), index=6)
+        batch_translation = st.checkbox('Translate each page in one request', False)
+        use_translation_cache = st.checkbox('Reuse previous translations', True)
+        translation_workers = st.number_input('Concurrent requests', value=1, min_value=1, max_value=32, step=1)
 
     # Device selection for inpainting
     inpainting_device=st.selectbox('Inpainting device',('cuda','cpu'), 0)
+    # The big-lama checkpoint and the models exported with `python cli.py export-inpainting`
+    inpainting_model_names = sorted(os.listdir('components/image_inpainting/models'))
+    inpainting_model_name = st.selectbox('Inpainting model', inpainting_model_names,
+                                         inpainting_model_names.index('big-lama') if 'big-lama' in inpainting_model_names else 0)
+    with st.expander("Inpainting", expanded=False):
+        inpainting_modes = {'Full page': 'full', 'Text regions only': 'regions', 'Skip LaMa on flat balloons': 'tiered'}
+        inpainting_mode = st.selectbox('Inpainting area', inpainting_modes.keys(), 0)
+        # The quantized modes only apply to the big-lama checkpoint on the CPU
+        inpainting_precision = st.selectbox('Inpainting CPU precision', PRECISIONS, 0,
+                                            disabled=inpainting_device != 'cpu' or inpainting_model_name.endswith(EXPORTED_MODEL_EXTENSIONS))
+        region_margin = st.number_input('Context around text (px)', value=32, min_value=0, step=8)
+        inpainting_resolutions = {'Full (best quality)': None, 'Up to 4 MP': 4_000_000, 'Up to 2 MP (faster)': 2_000_000, 'Up to 1 MP (fastest)': 1_000_000}
+        inpainting_resolution = st.selectbox('Inpainting resolution', inpainting_resolutions.keys(), 0)
+        inpainting_batch_size = st.number_input('Inpainting batch size', value=1, min_value=1, max_value=16, step=1)
 
     # Text injection settings
     with st.expander("Text injection", expanded=False):
         fontSize = st.number_input('Font_size',value=15,step=1)
         font_style=st.selectbox('Font',fonts.keys())
+        injection_workers = st.number_input('Rendering processes', value=1, min_value=1, max_value=os.cpu_count(), step=1)
 
     with st.sidebar:
         debug_text = st.checkbox("DEBUG_TEXT", False)
         debug_mask = st.checkbox("DEBUG_MASK", False)
+        save_intermediate = st.checkbox("Add intermediate results to the download", False)
+        profile_pipeline = st.checkbox("Profile the pipeline", False)
+        download_cbz = st.checkbox("Download as CBZ", False)
 
 # Load cached data
 ##############################################################
@@ -211,23 +245,21 @@ def modify_sys_path():
 modify_sys_path()
 
 @st.cache_resource
-def load_segmentation_model(segmentation_device, model_name):
+def load_segmentation_model(segmentation_device, model_name, precision):
     """
     Loads and returns the text segmentation model based on the specified device (cuda or cpu).
 
     Parameters:
     - device (str): The device to use for the model ('cuda' or 'cpu').
+    - precision (str): 'fp32', 'int8' or 'bf16', only used on CPU.
 
     Returns:
     - The loaded text segmentation model.
     """
-    defaults.device = torch.device(segmentation_device)
-    model = load_learner('.', f'components/text_detection/models/{model_name}')
-
-    return model
+    return pipeline.load_segmentation_model(segmentation_device, model_name, precision if segmentation_device == 'cpu' else 'fp32')
 
 # Load the text segmentation model using the selected device
-text_segmentation_model = load_segmentation_model(segmentation_device, model_name)
+text_segmentation_model = load_segmentation_model(segmentation_device, model_name, segmentation_precision)
 
 @st.cache_resource
 def load_ocr(ocr_device, ocr_type, ocr_lang):
@@ -240,42 +272,49 @@ def load_ocr(ocr_device, ocr_type, ocr_lang):
     Returns:
     - An instance of the MangaOcr model.
     """
-    if ocr_device == "cuda":
-        if ocr_type == "manga_ocr":
-            mocr = MangaOcr(force_cpu=False)
-        elif ocr_type == "easyocr":
-            mocr = easyocr.Reader(ocr_lang, gpu=True)
-        # elif ocr_type == "PaddleOCR":
-        #     mocr = paddleocr.PaddleOCR(lang=ocr_lang)
-    else:
-        if ocr_type == "manga_ocr":
-            mocr = MangaOcr(force_cpu=True)
-        elif ocr_type == "easyocr":
-            mocr = easyocr.Reader(ocr_lang, gpu=False)
-        # elif ocr_type == "PaddleOCR":
-        #     mocr = paddleocr.PaddleOCR(lang=ocr_lang)
-
-    return mocr
+    return pipeline.load_ocr(ocr_device, ocr_type, ocr_lang)
 
 # Load the OCR model using the selected device
 ocr_model = load_ocr(ocr_device, ocr_type, ocr_lang)
 
 @st.cache_resource
-def set_inpainting_device(inpainting_device):
+def load_inpainting_model(inpainting_device, inpainting_model_name, precision):
     """
-    Configures the device setting for the image inpainting model in its configuration file.
+    Loads the LaMa inpainting model once and keeps it resident for the following runs.
 
     Parameters:
     - device (str): The device to use for inpainting ('cuda' or 'cpu').
+    - inpainting_model_name (str): The big-lama directory or an exported .pt model.
+    - precision (str): 'fp32', 'int8' or 'bf16', only used on CPU with the big-lama checkpoint.
+
+    Returns:
+    - The loaded inpainting model.
+    """
+    if inpainting_device != 'cpu' or inpainting_model_name.endswith(EXPORTED_MODEL_EXTENSIONS):
+        precision = 'fp32'
+    return pipeline.load_inpainting_model(inpainting_device, os.path.join('components/image_inpainting/models', inpainting_model_name),
+                                          precision=precision)
+
+# Load the inpainting model using the selected device
+inpainting_model = load_inpainting_model(inpainting_device, inpainting_model_name, inpainting_precision)
+
+@st.cache_resource
+def load_translation_cache():
+    """
+    Opens the persistent translation cache shared by every session.
+    """
+    return TranslationCache('cache/translations.sqlite')
+
+translation_cache = load_translation_cache()
+
+@st.cache_resource
+def load_ocr_cache():
+    """
+    Opens the persistent OCR cache shared by every session.
     """
-    yaml = YAML()
-    mf = pathlib.Path('components/image_inpainting/configs/prediction/default.yaml')
-    doc = yaml.load(mf)
-    doc['device'] = inpainting_device
-    yaml.dump(doc, mf)
+    return OcrCache('cache/ocr.sqlite')
 
-# Configure the device for the inpainting model
-set_inpainting_device(inpainting_device)
+ocr_cache = load_ocr_cache()
 
 # Main content
 ##############################################################
@@ -305,6 +344,8 @@ if st.session_state['init']:
     if st.button('Process Files'):
         # Record the start time of the process
         st.session_state['start_time'] = time.time()
+        st.session_state['profiler'] = profiling.Profiler() if profile_pipeline else None
+        profiler = st.session_state['profiler']
         
         # Create a containers for progress updates
         progress_container = st.empty()
@@ -314,14 +355,19 @@ if st.session_state['init']:
         # Count the total number of uploaded files
         total_files = len(uploaded_files)
 
-        # Process each uploaded file for text segmentation
-        for i, uploaded_file in enumerate(uploaded_files):
-            text_segmentation(
-                file = uploaded_file, 
-                learner = text_segmentation_model
+        with profiling.stage(profiler, 'segmentation', pages=total_files):
+            # Decode the uploaded files once, the pages are handed between stages in memory
+            st.session_state['pages'] = deduplicate_pages([Page.from_file(uploaded_file) for uploaded_file in uploaded_files])
+
+            # Process the uploaded files for text segmentation in batches
+            text_segmentation_batch(
+                pages = st.session_state['pages'], 
+                learner = text_segmentation_model,
+                batch_size = int(segmentation_batch_size),
+                tile_size = int(tile_size) or None,
+                tile_overlap = int(tile_overlap),
+                callback = lambda done: update_progress(total_files, progress_bar, done - 1)
             )
-
-            update_progress(total_files, progress_bar, i)
             torch.cuda.empty_cache()
 
         # Update the progress
@@ -331,11 +377,12 @@ if st.session_state['init']:
         progress_bar = st.progress(0)
 
         # Detect text blocks in each segmented text
-        for i, uploaded_file in enumerate(uploaded_files):
-            st.session_state['blocks'].append(block_detection(
-                file=uploaded_file, 
-                dilation_iterations=dilation_iter
-            ))
+        for i, page in enumerate(st.session_state['pages']):
+            with profiling.stage(profiler, 'block detection'):
+                block_detection(
+                    page=page, 
+                    dilation_iterations=dilation_iter
+                )
 
             update_progress(total_files, progress_bar, i)
             torch.cuda.empty_cache()
@@ -354,16 +401,14 @@ if st.session_state['init']:
 if Modify and st.session_state['process files']:
     # Ensure the current file index is within the range of uploaded files
     if st.session_state['current_file_index'] < len(uploaded_files):
-        current_file = uploaded_files[st.session_state['current_file_index']]
-        file_name = current_file.name
-        name, _ = os.path.splitext(file_name)
+        current_page = st.session_state['pages'][st.session_state['current_file_index']]
 
-        # Load the background image for the current file
-        bg_image = Image.open(f'prediction/segmentation/{name}/{name}.png')
+        # Use the segmented page as the background image
+        bg_image = Image.fromarray(current_page.image)
         width, height = bg_image.size
 
         # Convert blocks to a format suitable for the canvas
-        blocks = blocks_to_json(st.session_state['blocks'][st.session_state['current_file_index']])
+        blocks = blocks_to_json(current_page.blocks)
         blocks = {"version": "4.4.0", "objects": blocks}
         blocks_json = json.dumps(blocks)
         blocks_json = json.loads(blocks_json)
@@ -396,7 +441,7 @@ if Modify and st.session_state['process files']:
                         # Save modifications and decrement the file index
                         canvas_json = json.dumps(canvas_result.json_data)
                         canvas_json = json.loads(canvas_json)
-                        modify_mask(current_file, blocks_json, canvas_json)
+                        modify_mask(current_page, blocks_json, canvas_json)
                         st.session_state['current_file_index'] -= 1
                         st.rerun()
 
@@ -407,7 +452,7 @@ if Modify and st.session_state['process files']:
                     # Save modifications and increment the file index
                     canvas_json = json.dumps(canvas_result.json_data)
                     canvas_json = json.loads(canvas_json)
-                    modify_mask(current_file, blocks_json, canvas_json)
+                    modify_mask(current_page, blocks_json, canvas_json)
                     st.session_state['current_file_index'] += 1
                     st.rerun()
 
@@ -416,7 +461,7 @@ if Modify and st.session_state['process files']:
                     # Save modifications and finalize the modification process
                     canvas_json = json.dumps(canvas_result.json_data)
                     canvas_json = json.loads(canvas_json)
-                    modify_mask(current_file, blocks_json, canvas_json)
+                    modify_mask(current_page, blocks_json, canvas_json)
 
                     # Create a containers for progress updates
                     progress_container = st.empty()
@@ -427,14 +472,11 @@ if Modify and st.session_state['process files']:
                     total_files = len(uploaded_files)
 
                     # Detect text blocks in each segmented text with the modified mask
-                    st.session_state['blocks'] = []
-
-                    # Detect text blocks in each segmented text
-                    for i, uploaded_file in enumerate(uploaded_files):
-                        st.session_state['blocks'].append(block_detection(
-                            file=uploaded_file, 
+                    for i, page in enumerate(st.session_state['pages']):
+                        block_detection(
+                            page=page, 
                             dilation_iterations=0
-                        ))
+                        )
 
                         update_progress(total_files, progress_bar, i)
                         torch.cuda.empty_cache()
@@ -463,20 +505,22 @@ if st.session_state['modify']:
 
     # Count the total number of uploaded files
     total_files = len(uploaded_files)
-
-    # Iterate over uploaded files to perform OCR
-    for i, uploaded_file in enumerate(uploaded_files):
-        st.session_state['texts'].append(ocr(
-            uploaded_file,
-            st.session_state['blocks'][i],  # Use the corresponding block for the current file
-            ocr_model,
-            ocr_type
-        ))
-        # Calculate the percentage completion
-        percent_complete = int(100 * (i + 1) / len(uploaded_files))
-        
+    profiler = st.session_state['profiler']
+
+    # Perform OCR on the blocks of several pages at a time, so the model runs on full batches
+    pages = st.session_state['pages']
+    ocr_pages_per_step = int(ocr_pages_per_step)
+    for i in range(0, len(pages), ocr_pages_per_step):
+        with profiling.stage(profiler, 'ocr', pages=len(pages[i:i + ocr_pages_per_step])):
+            ocr_batch(
+                pages[i:i + ocr_pages_per_step],
+                ocr_model,
+                ocr_type,
+                batch_size=int(ocr_batch_size),
+                cache=ocr_cache if use_ocr_cache else None
+            )
         # Update the progress bar with the current percentage
-        progress_bar.progress(percent_complete)
+        update_progress(total_files, progress_bar, min(i + ocr_pages_per_step, total_files) - 1)
     
     torch.cuda.empty_cache()
 
@@ -486,26 +530,24 @@ if st.session_state['modify']:
     progress_container.write("Text translation in progress...")
     progress_bar = st.progress(0)
 
-    # Initialize the translator with DeepL API key
-    if provider == "DeepL":
-        translator = deepl.Translator(deepl_key)
-    elif provider == "Ollama":
-        translator = OllamaTranslator(model=ollama_model)
-    elif provider == "GoogleTrans":
-        translator = GoogleTrans()
-    
+    # Initialize the translator for the selected provider
+    translator = pipeline.load_translator(
+        provider,
+        deepl_key=deepl_key if provider == "DeepL" else None,
+        ollama_model=ollama_model,
+    )
 
     # Translate the recognized texts for each uploaded file
-    for i, uploaded_file in enumerate(uploaded_files):
-        original_text = st.session_state['texts'][i]
-
-        translated = translate_texts(
-            text=original_text,
-            target_language=languages[target_language],
-            translator=translator,
-        )
-
-        st.session_state['text_translated'].append(translated)
+    for i, page in enumerate(st.session_state['pages']):
+        with profiling.stage(profiler, 'translation'):
+            page.translations = translate_texts(
+                text=page.texts,
+                target_language=languages[target_language],
+                translator=translator,
+                max_workers=int(translation_workers),
+                batch=batch_translation,
+                cache=translation_cache if use_translation_cache else None,
+            )
 
         update_progress(total_files, progress_bar, i)
 
@@ -518,8 +560,24 @@ if st.session_state['modify']:
     if provider == "DeepL":
         st.write(translator.get_usage())
 
+    # Display the translation cache hits and misses
+    if use_translation_cache:
+        st.write(f"Translation cache: {translation_cache.stats()}")
+
     # Perform image inpainting on the detected text blocks
-    inpainting()
+    with profiling.stage(profiler, 'inpainting', pages=total_files):
+        inpainting_paths = inpainting(
+            st.session_state['pages'],
+            inpainting_model,
+            mode=inpainting_modes[inpainting_mode],
+            region_margin=int(region_margin),
+            batch_size=int(inpainting_batch_size),
+            max_pixels=inpainting_resolutions[inpainting_resolution],
+        )
+        torch.cuda.empty_cache()
+    if inpainting_paths:
+        progress_container.write(f"Inpainted {inpainting_paths['solid']} text areas with a solid fill, "
+                                 f"{inpainting_paths['classical']} with OpenCV and {inpainting_paths['lama']} with LaMa")
 
 
     progress_container.write("Image inpainting in progress...")
@@ -528,17 +586,29 @@ if st.session_state['modify']:
     # Update the progress
     progress_container.write("Text injection in progress...")
 
-    # Begin text injection into the inpainted images
-    for i, uploaded_file in enumerate(uploaded_files):
-        text_injection(
-            uploaded_file,
-            texts=st.session_state['text_translated'][i],
-            blocks=st.session_state['blocks'][i],
+    # Begin text injection into the inpainted images, rendering the pages in parallel processes
+    # and adding every page to the download archive as soon as it is finished. A large archive
+    # rolls over to a file in the workspace of the session
+    archive = PageArchive(cbz=download_cbz, directory=st.session_state['workspace'].path)
+    with profiling.stage(profiler, 'text injection', pages=total_files):
+        text_injection_parallel(
+            st.session_state['pages'],
             font=fonts[font_style],
-            fontSize=fontSize
+            fontSize=fontSize,
+            processes=injection_workers,
+            archive=archive,
+            callback=lambda done, total: update_progress(total, progress_bar, done - 1),
         )
-        # Calculate the percentage completion
-        update_progress(total_files, progress_bar, i)
+
+    # Add the intermediate results to the download archive when requested, the server-side
+    # files are not reachable by the user
+    if save_intermediate:
+        for page in st.session_state['pages']:
+            for path, image in page.intermediate_images():
+                if not path.startswith('translated/'):
+                    archive.add(f'intermediate/{path}', encode_png(image))
+        st.write("Intermediate results added to the download, in the intermediate folder")
+    st.session_state['archive'] = (archive.file_name, archive.close())
         
     # Update the progress
     progress_bar.progress(100)
@@ -550,6 +620,12 @@ if st.session_state['modify']:
     elapsed_time = end_time - st.session_state['start_time']  
     st.write(f"Elapsed Time: {elapsed_time} seconds")   
 
+    # Display the per-stage timings of the run
+    if profiler is not None:
+        st.code(profiler.report())
+        st.download_button("Download profile (JSON)", profiler.to_json(), file_name='profile.json')
+        st.download_button("Download profile (CSV)", profiler.to_csv(), file_name='profile.csv')
+
     # Update session state
     st.session_state['modify'] = False
     st.session_state['init'] = True
@@ -562,39 +638,30 @@ if st.session_state['download']:
         st.markdown("## DEBUG")
         import pandas as pd
         debug_data = {
-            "DETECTED TEXT": st.session_state.get("texts", []),
-            "TRANSLATED TEXT": st.session_state.get("text_translated", [])
+            "DETECTED TEXT": [page.texts for page in st.session_state['pages']],
+            "TRANSLATED TEXT": [page.translations for page in st.session_state['pages']]
         }
         df = pd.DataFrame(debug_data)
         st.dataframe(df)
 
     if debug_mask:
         st.markdown("### MASK")
-        for uploaded_file in uploaded_files:
-            file_name = uploaded_file.name
-            name, _ = os.path.splitext(file_name)
-            mask_path = f'prediction/segmentation/{name}/{name}_mask.png'
-            st.image(mask_path, caption=f"Маска для {file_name}")
-
-    current_directory = os.getcwd()
-
-    # Create a zip archive of the translated files
-    shutil.make_archive('translated', 'zip', f'{current_directory}/prediction/translated')
-
-    # Open and make download button of zip file
-    with open('translated.zip', 'rb') as f:
-        st.download_button("Download as zip", f, file_name='translated.zip')
+        for page in st.session_state['pages']:
+            st.image(page.mask, caption=f"Маска для {page.file_name}")
+
+    # Make download button of the archive built while the pages were finished. Streamlit reads
+    # the file into memory to serve it, so the spooled file is closed as soon as it is handed over
+    file_name, archive_file = st.session_state['archive']
+    with archive_file:
+        st.download_button(f"Download as {file_name.rsplit('.', 1)[-1]}", archive_file, file_name=file_name)
+    st.session_state['archive'] = None
     
-    # Clean up workspace
-    if debug_mask:
-        shutil.rmtree(f'{current_directory}/prediction')
-        os.remove('translated.zip')
-        shutil.rmtree(f'{current_directory}/outputs')
+    # Clean up the workspace once the job is finished; it is removed with the session in any case
+    st.session_state['workspace'].cleanup()
+    st.session_state['workspace'] = Workspace()
 
     # Reset various lists and flags in the session state to their initial values
-    st.session_state['blocks'] = []
-    st.session_state['texts'] = []
-    st.session_state['text_translated'] = []
+    st.session_state['pages'] = []
     st.session_state['init'] = True
     st.session_state['download'] = False
 
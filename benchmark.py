@@ -0,0 +1,356 @@
+"""
+End-to-end benchmark of the MangaQuick pipeline on synthetic manga pages.
+
+Pages are generated offline with the text synthesis tools of the text segmentation training
+code (`textify`, `TextGenerator` and `RectangleGenerator`), so every run with the same seed
+sees the same pages. Every stage runs on CPU and translation uses an offline stub translator.
+Stages whose model files are missing are replaced by the ground truth of the synthetic page
+and are not timed.
+
+For each resolution and balloon count, the benchmark records the pages per second and the
+latency percentiles of every stage and the peak memory. Every configuration runs in a fresh
+process, so its peak memory is its own. The results can be stored as a baseline and later
+runs compared against it.
+
+Example:
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json
+"""
+# Standard library imports
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Third-party library imports
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+# The text synthesis modules import each other as top-level modules
+if './components/text_detection' not in sys.path:
+    sys.path.append('./components/text_detection')
+
+# Custom module imports
+from transforms import textify
+from TextGenerator import TextGenerator, Fonts
+from RectangleGenerator import RectangleGenerator
+from components.page import Page
+from components.profiling import peak_rss_mb
+from components.text_detection.text_segmentation import text_segmentation_batch
+from components.text_block_detection import block_detection
+from components.text_recognition import ocr_batch
+from components.text_translation import translate_texts
+from components.image_inpainting.inpainting import inpainting
+from components.text_injection import text_injection
+from components.pipeline import load_inpainting_model, load_ocr, load_segmentation_model
+
+STAGES = ('segmentation', 'block detection', 'ocr', 'translation', 'inpainting', 'text injection')
+
+class StubTranslator:
+    """
+    Offline translator returning the source texts upper-cased, after an optional fixed latency
+    per request that stands for the network round trip.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def translate_text(self, text, *context, target_lang=None):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(text=text.upper())
+
+    def translate_batch(self, texts, target_lang):
+        time.sleep(self.latency)
+        return [types.SimpleNamespace(text=text.upper()) for text in texts]
+
+class SyntheticImage:
+    """
+    Minimal stand-in for the dataset images expected by `textify`.
+    """
+    def __init__(self, image):
+        self.image = image
+        self.rects = []
+
+def synthetic_page(name, width, height, balloons, fonts, seed, scattered_text=False):
+    """
+    Generates a manga-like page: a screentone background, speech balloons filled with text at
+    the rectangles of `RectangleGenerator` and, optionally, text scattered over the background
+    by `textify`.
+
+    Parameters:
+    - name (str): File name of the page.
+    - width, height (int): Size of the page.
+    - balloons (int): Maximum number of speech balloons.
+    - fonts (Fonts): Fonts used to draw the text.
+    - seed (int): Seed of the random generators, so the same page is generated on every run.
+    - scattered_text (bool): Also draw the text of `textify` (up to 15 text rectangles or a
+      page-sized one, whatever the balloon count) over the background.
+
+    Returns:
+    - (Page, np.ndarray): The page and its ground truth text mask.
+    """
+    np.random.seed(seed)
+
+    # Panels of flat tones with a little noise
+    background = np.full((height, width), 255, dtype=np.float32)
+    for _ in range(4):
+        x, y = np.random.randint(0, width // 2), np.random.randint(0, height // 2)
+        background[y:y + height // 2, x:x + width // 2] = np.random.randint(150, 250)
+    background += np.random.normal(0, 6, background.shape)
+    background = np.clip(background, 0, 255).astype(np.uint8)
+    image = Image.fromarray(np.stack([background] * 3, axis=-1))
+
+    # Scattered text over the background, the same way the segmentation training pages are made
+    if scattered_text:
+        synthetic = textify(SyntheticImage(image), fonts)
+        page_image = synthetic.pil_img_x
+        difference = np.abs(np.asarray(page_image, dtype=np.int16) - np.asarray(synthetic.pil_img_y, dtype=np.int16))
+        mask = Image.fromarray(np.where(difference.max(axis=-1) > 30, 255, 0).astype(np.uint8))
+    else:
+        page_image = image
+        mask = Image.new('L', image.size, 0)
+
+    # Speech balloons with text inside
+    page_draw = ImageDraw.Draw(page_image)
+    mask_draw = ImageDraw.Draw(mask)
+    for rect in RectangleGenerator.generate(width, height, balloons):
+        box = (rect.x, rect.y, rect.x + rect.width, rect.y + rect.height)
+        page_draw.ellipse(box, fill=(255, 255, 255), outline=(0, 0, 0), width=max(2, width // 500))
+        mask_draw.ellipse(box, fill=0)
+
+        font = fonts.randomFont()
+        sized_font = font.getFont(max(10, int(np.random.randint(14, 28) * height / 1500)))
+        text = font.generateText(max(4, rect.area() // (sized_font.size ** 2) // 2))
+        inner_width, inner_height = int(rect.width * 0.7), int(rect.height * 0.7)
+        lines = TextGenerator.text_wrap(text, sized_font, inner_width, inner_height)
+        position = (rect.x + (rect.width - inner_width) // 2, rect.y + (rect.height - inner_height) // 2)
+        page_draw.multiline_text(position, '\n'.join(lines), fill=(0, 0, 0), font=sized_font)
+        mask_draw.multiline_text(position, '\n'.join(lines), fill=255, font=sized_font)
+
+    return Page(name, np.array(page_image.convert('RGB'))), np.array(mask)
+
+def load_models(args):
+    """
+    Loads the models available on disk on CPU.
+
+    Returns:
+    - dict: The loaded models by stage, None for the stages whose model is missing.
+    """
+    models = {'segmentation': None, 'ocr': None, 'inpainting': None}
+    model_dir = 'components/text_detection/models'
+    model_names = sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []
+    if 'segmentation' in args.stages and model_names:
+        models['segmentation'] = load_segmentation_model('cpu', args.model or model_names[0])
+    if 'ocr' in args.stages:
+        try:
+            models['ocr'] = load_ocr('cpu', 'manga_ocr')
+        except Exception as ex: # The model cannot be downloaded when offline
+            print(f'OCR model unavailable, using placeholder texts: {ex}')
+    if 'inpainting' in args.stages and os.path.isdir('components/image_inpainting/models/big-lama'):
+        models['inpainting'] = load_inpainting_model('cpu')
+    return models
+
+def run_page(page, ground_truth, models, translator, args):
+    """
+    Runs every stage on a page.
+
+    Returns:
+    - dict: Wall time in seconds of every stage that was run with its real implementation.
+    """
+    timings = {}
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        func()
+        timings[stage] = time.perf_counter() - start
+
+    if models['segmentation'] is not None:
+        timed('segmentation', lambda: text_segmentation_batch([page], models['segmentation'], batch_size=1))
+    else:
+        page.mask = ground_truth.copy()
+
+    if 'block detection' in args.stages:
+        timed('block detection', lambda: block_detection(page, dilation_iterations=3))
+    else:
+        block_detection(page, dilation_iterations=3)
+
+    if models['ocr'] is not None:
+        timed('ocr', lambda: ocr_batch([page], models['ocr'], 'manga_ocr'))
+    else:
+        page.texts = [f'text of block {i}' for i in range(len(page.blocks))]
+
+    def translation():
+        page.translations = translate_texts(page.texts, 'EN-US', translator, max_workers=args.translation_workers,
+                                            batch=args.batch_translation)
+    if 'translation' in args.stages:
+        timed('translation', translation)
+    else:
+        page.translations = list(page.texts)
+
+    if models['inpainting'] is not None:
+        timed('inpainting', lambda: inpainting([page], models['inpainting']))
+    else:
+        page.inpainted = page.image.copy()
+
+    if 'text injection' in args.stages:
+        timed('text injection', lambda: text_injection(page, font=args.font, fontSize=args.font_size))
+
+    return timings
+
+def run_config(width, height, balloons, args):
+    """
+    Benchmarks every stage on `args.pages` synthetic pages of one size and balloon count.
+
+    It runs in its own process (see `main`), which loads the models, so the peak memory is the
+    one of this configuration only and not of the largest one run before it.
+
+    Returns:
+    - dict: The pages per second and latency percentiles of every stage, and the peak memory.
+    """
+    torch.set_num_threads(args.threads or os.cpu_count())
+    fonts = Fonts(Fonts.load(Path(args.fonts_dir)))
+    models = load_models(args)
+    translator = StubTranslator(args.translation_latency)
+
+    latencies = {}
+    for i in range(args.warmup + args.pages):
+        page, ground_truth = synthetic_page(f'page_{i:03}.png', width, height, balloons, fonts, args.seed + i,
+                                            scattered_text=args.scattered_text)
+        timings = run_page(page, ground_truth, models, translator, args)
+        if i < args.warmup:
+            continue
+        for stage, elapsed in timings.items():
+            latencies.setdefault(stage, []).append(elapsed)
+
+    stages = {}
+    for stage in STAGES:
+        if stage not in latencies:
+            continue
+        values = np.array(latencies[stage])
+        stages[stage] = {
+            'pages_per_s': len(values) / values.sum() if values.sum() > 0 else float('inf'),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+        }
+    return {'stages': stages, 'peak_rss_mb': peak_rss_mb()}
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the throughput of every stage with the baseline.
+
+    Returns:
+    - (str, list of str): A printable comparison table and the regressions found, i.e. the
+      stages whose pages per second dropped by more than `tolerance`.
+    """
+    lines = [f"{'Config':<22}{'Stage':<18}{'Baseline/s':>12}{'Current/s':>12}{'Change':>9}"]
+    regressions = []
+    for config, result in results['configs'].items():
+        for stage, metrics in result['stages'].items():
+            base = baseline['configs'].get(config, {}).get('stages', {}).get(stage)
+            if base is None:
+                continue
+            change = metrics['pages_per_s'] / base['pages_per_s'] - 1
+            lines.append(f"{config:<22}{stage:<18}{base['pages_per_s']:>12.2f}{metrics['pages_per_s']:>12.2f}{change:>+9.1%}")
+            if change < -tolerance:
+                regressions.append(f'{config} {stage}: {change:+.1%}')
+    return '\n'.join(lines), regressions
+
+def report(results):
+    """
+    Returns a printable table of the benchmark results.
+    """
+    lines = [f"{'Config':<22}{'Stage':<18}{'Pages/s':>10}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}"]
+    for config, result in results['configs'].items():
+        for stage, metrics in result['stages'].items():
+            lines.append(f"{config:<22}{stage:<18}{metrics['pages_per_s']:>10.2f}{metrics['p50']:>9.3f}"
+                         f"{metrics['p90']:>9.3f}{metrics['p99']:>9.3f}")
+        lines.append(f"{config:<22}{'peak RSS':<18}{result['peak_rss_mb']:>10.0f} MB")
+    return '\n'.join(lines)
+
+def parse_size(value):
+    width, _, height = value.lower().partition('x')
+    if not width.isdigit() or not height.isdigit():
+        raise argparse.ArgumentTypeError(f'Invalid resolution {value}, expected WIDTHxHEIGHT')
+    return int(width), int(height)
+
+def parse_args(argv=None):
+    """
+    Parses the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='MangaQuick pipeline benchmark on synthetic pages')
+    parser.add_argument('--resolutions', nargs='+', type=parse_size, default=[(827, 1170), (1654, 2340)],
+                        metavar='WxH', help='Page sizes to benchmark')
+    parser.add_argument('--balloons', nargs='+', type=int, default=[4, 12], help='Speech balloons per page')
+    parser.add_argument('--scattered-text', action='store_true',
+                        help='Also draw random text over the page background, independent of the balloon count')
+    parser.add_argument('--pages', type=int, default=8, help='Measured pages per configuration')
+    parser.add_argument('--warmup', type=int, default=1, help='Pages run before measuring each configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), help='Stages to measure (use quotes for names with spaces)')
+    parser.add_argument('--model', default=None, help='Text segmentation model file name')
+    parser.add_argument('--fonts-dir', default='text_fonts', help='Fonts used to draw the synthetic text')
+    parser.add_argument('--font', default=sorted(os.listdir('text_fonts'))[0], help='Font file name inside text_fonts for text injection')
+    parser.add_argument('--font-size', type=int, default=15)
+    parser.add_argument('--translation-latency', type=float, default=0.0, help='Simulated latency in seconds of every translation request')
+    parser.add_argument('--translation-workers', type=int, default=1)
+    parser.add_argument('--batch-translation', action='store_true')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads used by PyTorch (defaults to all cores)')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--save-baseline', default=None, metavar='PATH', help='Store the results as the baseline in PATH')
+    parser.add_argument('--baseline', default=None, metavar='PATH', help='Compare the results with the baseline stored in PATH')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Throughput drop reported as a regression (0.1 = 10%%)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        print(f'Unknown stages {sorted(unknown)}, expected some of {list(STAGES)}')
+        return 2
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'threads': args.threads or os.cpu_count(),
+        },
+        'settings': {'pages': args.pages, 'warmup': args.warmup, 'seed': args.seed, 'stages': args.stages,
+                     'scattered_text': args.scattered_text},
+        'configs': {},
+    }
+    for width, height in args.resolutions:
+        for balloons in args.balloons:
+            config = f'{width}x{height}/{balloons}b'
+            print(f'Benchmarking {config}...')
+            # A fresh process per configuration, so its peak memory is measured on its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results['configs'][config] = executor.submit(run_config, width, height, balloons, args).result()
+
+    print(report(results))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f'Results written to {path}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        table, regressions = compare(results, baseline, args.tolerance)
+        print(table)
+        if regressions:
+            print('Performance regressions:\n' + '\n'.join(regressions))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
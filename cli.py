@@ -0,0 +1,317 @@
+"""
+Headless batch entry point for MangaQuick.
+
+Runs the same stages as the Streamlit application (text segmentation, block detection,
+OCR, translation, inpainting and text injection) over a directory, an archive or a single
+page, loading every model only once.
+
+Example:
+    python cli.py run chapter_01/ translated/chapter_01 --provider DeepL --target-language EN-US
+"""
+# Standard library imports
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import collections
+
+# Third-party library imports
+import torch
+from dotenv import load_dotenv
+
+# Custom module imports
+from components import profiling
+from components.export import PageArchive
+from components.workspace import Workspace
+from components.image_inpainting.inpainting import DEFAULT_MODEL_PATH, EXPORTED_MODEL_EXTENSIONS, export_inpainting_model
+from components.quantization import PRECISIONS
+from components.ocr_cache import OcrCache
+from components.translation_cache import TranslationCache
+from components.pipeline import (
+    DEFAULT_STAGE_WORKERS,
+    load_inpainting_model,
+    load_ocr,
+    load_pages,
+    load_segmentation_model,
+    load_translator,
+    run_pipeline,
+    run_pipeline_streaming,
+)
+
+def default_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+def parse_stage_workers(values):
+    """
+    Parses `stage=count` pairs, with underscores standing for spaces in the stage names.
+    """
+    workers = {}
+    for value in values or []:
+        stage, _, count = value.partition('=')
+        stage = stage.replace('_', ' ')
+        if stage not in DEFAULT_STAGE_WORKERS or not count.isdigit():
+            raise argparse.ArgumentTypeError(f'Invalid stage workers {value}, expected one of {list(DEFAULT_STAGE_WORKERS)}=<count>')
+        workers[stage] = int(count)
+    return workers
+
+def parse_args(argv=None):
+    """
+    Parses the command line arguments of the headless runner.
+    """
+    parser = argparse.ArgumentParser(prog='cli.py', description='MangaQuick headless batch translator')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Translate every page of a directory or archive')
+    run.add_argument('indir', help='Directory of pages, .zip/.cbz archive or a single image')
+    run.add_argument('outdir', help='Directory where the translated pages are written')
+
+    # Text segmentation and block detection
+    model_names = sorted(os.listdir('components/text_detection/models')) if os.path.isdir('components/text_detection/models') else []
+    run.add_argument('--model', default=model_names[0] if model_names else None, help='Text segmentation model file name')
+    run.add_argument('--segmentation-device', default=default_device(), choices=('cuda', 'cpu'))
+    run.add_argument('--segmentation-precision', default='fp32', choices=PRECISIONS,
+                     help='Run the segmentation model with dynamic int8 quantization or bf16 autocast (CPU only)')
+    run.add_argument('--quantization-config', default=None, metavar='PATH',
+                     help='JSON written by quantization_check.py --calibrate with the layers kept in fp32 in int8 mode')
+    run.add_argument('--segmentation-batch-size', type=int, default=4, help='Pages per text segmentation forward pass')
+    run.add_argument('--tile-size', type=int, default=None, help='Segment pages larger than this in overlapping tiles of this size')
+    run.add_argument('--tile-overlap', type=int, default=128, help='Overlap between neighbouring segmentation tiles')
+    run.add_argument('--dilation-iterations', type=int, default=3)
+
+    # OCR
+    run.add_argument('--ocr', dest='ocr_type', default='manga_ocr', choices=('manga_ocr', 'easyocr'))
+    run.add_argument('--ocr-device', default=default_device(), choices=('cuda', 'cpu'))
+    run.add_argument('--ocr-batch-size', type=int, default=16, help='Text blocks recognized per OCR forward pass')
+    run.add_argument('--ocr-cache', default='cache/ocr.sqlite', help='SQLite file of the persistent OCR cache')
+    run.add_argument('--no-ocr-cache', action='store_true', help='Recognize every block even if its crop was recognized before')
+    run.add_argument('--ocr-lang', default='en, ja', help='Comma separated source languages (easyocr only)')
+
+    # Translation
+    run.add_argument('--provider', default='GoogleTrans', choices=('GoogleTrans', 'Ollama', 'DeepL'))
+    run.add_argument('--target-language', default='EN-US', help='Target language code, e.g. EN-US or ES')
+    run.add_argument('--deepl-key', default=None, help='DeepL API key (defaults to DEEPL_KEY)')
+    run.add_argument('--ollama-model', default=None)
+    run.add_argument('--batch-translation', action='store_true', help='Translate all the texts of a page with a single request')
+    run.add_argument('--pages-per-request', type=int, default=1, help='Pages joined in one batch translation request')
+    run.add_argument('--translation-cache', default='cache/translations.sqlite', help='SQLite file of the persistent translation cache')
+    run.add_argument('--no-translation-cache', action='store_true', help='Translate every text even if it was translated before')
+    run.add_argument('--translation-workers', type=int, default=1, help='Maximum number of translation requests in flight')
+
+    # Inpainting and text injection
+    run.add_argument('--inpainting-device', default=default_device(), choices=('cuda', 'cpu'))
+    run.add_argument('--inpainting-model', default=DEFAULT_MODEL_PATH,
+                     help='big-lama directory, or a model exported with the export-inpainting command (.pt)')
+    run.add_argument('--inpainting-precision', default='fp32', choices=PRECISIONS,
+                     help='Run the inpainting model with dynamic int8 quantization or bf16 autocast (CPU only)')
+    run.add_argument('--inpainting-mode', default='full', choices=('full', 'regions', 'tiered'),
+                     help='Inpaint the whole page, only the regions around the text blocks, or fill the text on flat '
+                          'backgrounds without the model and inpaint the rest as regions (tiered)')
+    run.add_argument('--classical-method', default='telea', choices=('telea', 'ns'),
+                     help='OpenCV algorithm inpainting the text on smooth backgrounds in tiered mode')
+    run.add_argument('--region-margin', type=int, default=32, help='Context in pixels kept around the text blocks in regions mode')
+    run.add_argument('--inpainting-max-megapixels', type=float, default=None,
+                     help='Inpaint larger pages at this resolution and blend the upscaled fill into the text areas (faster, softer fill)')
+    run.add_argument('--inpainting-batch-size', type=int, default=1, help='Pages or regions of the same padded size inpainted per forward pass')
+    run.add_argument('--inpainting-loader-workers', type=int, default=0,
+                     help='Worker processes preparing the next inpainting batch while the current one runs')
+    run.add_argument('--font', default=sorted(os.listdir('text_fonts'))[0], help='Font file name inside text_fonts')
+    run.add_argument('--font-size', type=int, default=15)
+    run.add_argument('--injection-workers', type=int, default=1, help='Worker processes rendering the translated pages (0 uses every core)')
+    run.add_argument('--chunk-size', type=int, default=50, help='Pages processed per pipeline pass')
+    run.add_argument('--threads', type=int, default=None, help='Intra-op threads used by PyTorch on CPU (defaults to all cores)')
+    run.add_argument('--stream', action='store_true', help='Overlap the stages across pages, writing every page as soon as it is finished')
+    run.add_argument('--queue-size', type=int, default=2, help='Pages waiting between two stages in streaming mode')
+    run.add_argument('--stage-workers', nargs='*', metavar='STAGE=N', help='Workers per stage in streaming mode, e.g. translation=8 text_injection=2')
+    run.add_argument('--profile', default=None, metavar='PATH', help='Write per-page and per-stage timings to PATH (.json or .csv)')
+    run.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this local port while running')
+    run.add_argument('--archive', choices=('zip', 'cbz'), default=None,
+                     help='Write the translated pages into a single archive in outdir, page by page, instead of PNG files')
+    run.add_argument('--save-intermediate', default=None, metavar='DIR', help='Save the intermediate results of every stage as PNG files in DIR')
+
+    export = subparsers.add_parser('export-inpainting', help='Export the LaMa inpainting model to TorchScript')
+    export.add_argument('output', help='Exported TorchScript model file (.pt)')
+    export.add_argument('--model-path', default=DEFAULT_MODEL_PATH, help='big-lama directory with config.yaml and models/')
+    export.add_argument('--checkpoint', default='best.ckpt', help='Checkpoint file name inside models/')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        # The quantized modes only run on CPU, and on the inpainting checkpoint
+        if args.segmentation_precision != 'fp32' and args.segmentation_device != 'cpu':
+            parser.error(f'--segmentation-precision {args.segmentation_precision} requires --segmentation-device cpu')
+        if args.inpainting_precision != 'fp32' and args.inpainting_device != 'cpu':
+            parser.error(f'--inpainting-precision {args.inpainting_precision} requires --inpainting-device cpu')
+        if args.inpainting_precision != 'fp32' and args.inpainting_model.endswith(EXPORTED_MODEL_EXTENSIONS):
+            parser.error(f'--inpainting-precision {args.inpainting_precision} requires the big-lama checkpoint, not an exported model')
+        # The streaming pipeline runs every stage one page at a time
+        if args.stream:
+            batch_flags = ('--chunk-size', '--segmentation-batch-size', '--injection-workers', '--pages-per-request')
+            ignored = [flag for flag in batch_flags if getattr(args, flag[2:].replace('-', '_')) != run.get_default(flag[2:].replace('-', '_'))]
+            if ignored:
+                parser.error(f"{', '.join(ignored)} cannot be used with --stream, which processes one page at a time "
+                             f"(set the workers of a stage with --stage-workers instead)")
+    return args
+
+def run(args):
+    """
+    Translates every page found in `args.indir` and writes the results to `args.outdir`.
+    """
+    files = load_pages(args.indir)
+    if not files:
+        print(f'No pages found in {args.indir}')
+        return 1
+    if args.model is None:
+        print('No text segmentation model found in components/text_detection/models')
+        return 1
+
+    # Let CPU inference use every core on the larger batched tensors
+    torch.set_num_threads(args.threads or os.cpu_count())
+
+    # Load every model once for the whole run
+    start_time = time.time()
+    quantization = {}
+    if args.quantization_config:
+        with open(args.quantization_config) as f:
+            quantization = json.load(f)
+    segmentation_model = load_segmentation_model(args.segmentation_device, args.model, args.segmentation_precision,
+                                                 quantization.get('segmentation', {}).get('keep_fp32', ()))
+    ocr_lang = [lang.strip() for lang in args.ocr_lang.split(',')]
+    ocr_model = load_ocr(args.ocr_device, args.ocr_type, ocr_lang)
+    translator = load_translator(
+        args.provider,
+        deepl_key=args.deepl_key or os.getenv('DEEPL_KEY'),
+        ollama_model=args.ollama_model,
+    )
+    inpainting_model = load_inpainting_model(args.inpainting_device, args.inpainting_model, precision=args.inpainting_precision,
+                                             keep_fp32=quantization.get('inpainting', {}).get('keep_fp32', ()))
+    inpainting_options = {
+        'mode': args.inpainting_mode,
+        'region_margin': args.region_margin,
+        'batch_size': args.inpainting_batch_size,
+        'num_workers': args.inpainting_loader_workers,
+        'max_pixels': int(args.inpainting_max_megapixels * 1e6) if args.inpainting_max_megapixels else None,
+        'classical_method': args.classical_method,
+        'paths': collections.Counter(),
+    }
+    translation_cache = None if args.no_translation_cache else TranslationCache(args.translation_cache)
+    ocr_cache = None if args.no_ocr_cache else OcrCache(args.ocr_cache)
+    print(f'Models loaded in {time.time() - start_time:.2f} seconds')
+
+    # The archive is built in the private workspace of the run and only moved to outdir once
+    # complete, so a failed run or another run writing to the same outdir never sees half of it
+    os.makedirs(args.outdir, exist_ok=True)
+    workspace = Workspace()
+    archive = None
+    if args.archive:
+        name = os.path.splitext(os.path.basename(os.path.normpath(args.indir)))[0]
+        archive = PageArchive(os.path.join(workspace.directory('archive'), f'{name}.{args.archive}'))
+
+    profiler = profiling.Profiler()
+    if args.metrics_port:
+        profiler.serve(args.metrics_port)
+        print(f'Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics')
+
+    with profiling.activate(profiler):
+        if args.stream:
+            first_page_time = []
+
+            def save_page(index, page):
+                if archive is not None:
+                    archive.add_page(page)
+                else:
+                    page.save_translated(args.outdir)
+                if not first_page_time:
+                    first_page_time.append(time.time() - start_time)
+                    print(f'First page translated after {first_page_time[0]:.2f} seconds')
+
+            run_pipeline_streaming(
+                files,
+                callback=save_page,
+                stage_workers=parse_stage_workers(args.stage_workers),
+                queue_size=args.queue_size,
+                save_dir=args.save_intermediate,
+                keep_results=False,
+                segmentation_model=segmentation_model,
+                ocr_model=ocr_model,
+                ocr_type=args.ocr_type,
+                translator=translator,
+                target_language=args.target_language,
+                inpainting_model=inpainting_model,
+                inpainting_options=inpainting_options,
+                font=args.font,
+                font_size=args.font_size,
+                dilation_iterations=args.dilation_iterations,
+                segmentation_tile_size=args.tile_size,
+                segmentation_tile_overlap=args.tile_overlap,
+                ocr_batch_size=args.ocr_batch_size,
+                ocr_cache=ocr_cache,
+                translation_workers=args.translation_workers,
+                translation_batch=args.batch_translation,
+                translation_cache=translation_cache,
+            )
+        else:
+            # Process the pages in chunks so the decoded pages held in memory stay bounded
+            for chunk_start in range(0, len(files), args.chunk_size):
+                chunk = files[chunk_start:chunk_start + args.chunk_size]
+                run_pipeline(
+                    chunk,
+                    segmentation_model=segmentation_model,
+                    ocr_model=ocr_model,
+                    ocr_type=args.ocr_type,
+                    translator=translator,
+                    target_language=args.target_language,
+                    inpainting_model=inpainting_model,
+                    inpainting_options=inpainting_options,
+                    font=args.font,
+                    font_size=args.font_size,
+                    dilation_iterations=args.dilation_iterations,
+                    segmentation_batch_size=args.segmentation_batch_size,
+                    segmentation_tile_size=args.tile_size,
+                    segmentation_tile_overlap=args.tile_overlap,
+                    ocr_batch_size=args.ocr_batch_size,
+                    translation_workers=args.translation_workers,
+                    translation_batch=args.batch_translation,
+                    pages_per_request=args.pages_per_request,
+                    translation_cache=translation_cache,
+                    ocr_cache=ocr_cache,
+                    injection_workers=args.injection_workers or os.cpu_count(),
+                    save_dir=args.save_intermediate,
+                    output_dir=None if archive is not None else args.outdir,
+                    archive=archive,
+                )
+                print(f'{min(chunk_start + args.chunk_size, len(files))}/{len(files)} pages translated')
+
+    if archive is not None:
+        archive.close()
+        archive_path = shutil.move(archive.path, os.path.join(args.outdir, archive.file_name))
+        print(f'{len(archive)} pages written to {archive_path}')
+    workspace.cleanup()
+    elapsed_time = time.time() - start_time
+    print(profiler.report())
+    if args.profile:
+        profiler.save(args.profile)
+        print(f'Profile written to {args.profile}')
+    if args.inpainting_mode == 'tiered':
+        print(f"Inpainting paths: {dict(inpainting_options['paths'])}")
+    if ocr_cache is not None:
+        print(f'OCR cache: {ocr_cache.stats()}')
+        ocr_cache.close()
+    if translation_cache is not None:
+        print(f'Translation cache: {translation_cache.stats()}')
+        translation_cache.close()
+    print(f'Elapsed Time: {elapsed_time:.2f} seconds ({len(files) / elapsed_time:.2f} pages/s)')
+    return 0
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    if args.command == 'run':
+        return run(args)
+    if args.command == 'export-inpainting':
+        difference = export_inpainting_model(args.output, args.model_path, checkpoint=args.checkpoint)
+        print(f'Inpainting model exported to {args.output} (max difference with the checkpoint: {difference:.2e})')
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class PersistentCache:
+    """
+    Key-value cache of strings stored in a SQLite database, with a small in-memory LRU in front.
+
+    When the database grows beyond `max_entries`, the least recently used entries are evicted;
+    hits in memory refresh the entry in the database too, so the frequently used entries stay.
+    The database is in WAL mode with `synchronous=NORMAL`, so the commit of every lookup or
+    store is an append to the log rather than an fsync.
+    Subclasses define how the keys are built, and the table and value column names, which must
+    stay the same as in the databases already written by earlier versions.
+    """
+    table = 'entries'
+    column = 'value'
+
+    def __init__(self, path, max_entries=100000, memory_entries=1024):
+        """
+        Parameters:
+        - path (str): SQLite database file.
+        - max_entries (int): Maximum number of entries kept in the database.
+        - memory_entries (int): Maximum number of entries kept in memory.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, {self.column} TEXT NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)')
+        self.connection.commit()
+        self.size = self.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns the cached value for the key, or None when it is not cached.
+        """
+        with self.lock:
+            if key in self.memory:
+                value = self.memory[key]
+            else:
+                row = self.connection.execute(f'SELECT {self.column} FROM {self.table} WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                value = row[0]
+            self.hits += 1
+            self.connection.execute(f'UPDATE {self.table} SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries beyond `max_entries`.
+        """
+        with self.lock:
+            exists = self.connection.execute(f'SELECT 1 FROM {self.table} WHERE key = ?', (key,)).fetchone() is not None
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, {self.column}, last_used) VALUES (?, ?, ?)',
+                (key, value, time.time())
+            )
+            if not exists:
+                self.size += 1
+            if self.size > self.max_entries:
+                self.connection.execute(
+                    f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)',
+                    (self.size - self.max_entries,)
+                )
+                self.size = self.max_entries
+            self.connection.commit()
+            self._remember(key, value)
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the number of cached entries.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self.size}
+
+    def close(self):
+        self.connection.close()
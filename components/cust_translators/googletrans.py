@@ -3,20 +3,42 @@ from googletrans import Translator
 import asyncio
 
 class GoogleTrans:
-    def __init__(self):
-        pass
-    
     def translate_text(self, text, target_lang):
-        target_lang = target_lang.split('-')[0].lower()
         return asyncio.run(self.async_translate_text(text, target_lang))
-        
 
-    async def async_translate_text(self, text, target_lang):
+
+    async def async_translate_text(self, text, target_lang, client=None):
         """
         Translates the given text to the target language using googletrans.
+        A client opened with `session` can be passed to share it between calls.
         """
+        target_lang = target_lang.split('-')[0].lower()
 
-        async with Translator() as translator:
-            result = await  translator.translate(text, dest=target_lang)
-            print(result.text)
+        if client is not None:
+            result = await client.translate(text, dest=target_lang)
+        else:
+            async with Translator() as translator:
+                result = await  translator.translate(text, dest=target_lang)
         return type('TranslationResult', (object,), {'text': result.text})()
+
+    def translate_batch(self, texts, target_lang):
+        """
+        Translates several texts with a single googletrans call.
+        """
+        return asyncio.run(self.async_translate_batch(texts, target_lang))
+
+    async def async_translate_batch(self, texts, target_lang):
+        target_lang = target_lang.split('-')[0].lower()
+
+        async with Translator() as translator:
+            results = await translator.translate(texts, dest=target_lang)
+        return [type('TranslationResult', (object,), {'text': result.text})() for result in results]
+
+    def session(self):
+        """
+        Returns a new googletrans client, to be opened with `async with` in the event loop of
+        the calls sharing it. The client is never stored on the translator, which is shared
+        by the threads of the pipeline.
+        """
+        return Translator()
+
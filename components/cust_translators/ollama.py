@@ -66,22 +66,61 @@ class OllamaTranslator:
             "system": self.system_prompt,
         }
 
-        try:
-            response = requests.post(self.api_url, json=payload)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            result = response.json()
-            output = result.get("response", "").strip()
-
-            matches = re.findall(r"<translation>(.*?)</translation>", output, re.DOTALL)
-            clean_text = matches[-1].strip() if matches else output  
-            clean_text = self.normalize_wide_letters(clean_text)
-
-            print(f'\n -------\n AI RESPONSE \n {output}\n---------------\n')
-            return type('TranslationResult', (object,), {'text': clean_text})()
-        except requests.RequestException as e:
-            print(f"Error communicating with Ollama: {e}")
-            return type('TranslationResult', (object,), {'text': ""})()
-        
+        # Request errors propagate, so the callers retry them
+        response = requests.post(self.api_url, json=payload)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        output = response.json().get("response", "").strip()
+
+        matches = re.findall(r"<translation>(.*?)</translation>", output, re.DOTALL)
+        clean_text = matches[-1].strip() if matches else output
+        clean_text = self.normalize_wide_letters(clean_text)
+        return type('TranslationResult', (object,), {'text': clean_text})()
+
+    def translate_batch(self, texts, target_lang):
+        """
+        Translates several texts with a single request, sending them as a numbered list.
+        Returns None when the numbered lines of the response cannot be matched to the texts.
+        """
+        texts = [katsu.romaji(text) if pattern.match(text) else text for text in texts]
+        segments_str = "\n".join(f'{i}: {x}' for i, x in enumerate(texts, start=1))
+
+        prompt = f"""
+        The following numbered lines are the texts of one manga page, in reading order:
+        '
+        {segments_str}
+        '
+
+        Your task is to translate every numbered line from its detected source language into {target_lang}. Use the other lines as context for names, speech style and jokes. Ensure that punctuation, lettercase, and names are translated consistently. Think in {target_lang} while translating. Make sure that translation is written on {target_lang}.
+
+        Answer with exactly one <translation> tag containing exactly {len(texts)} lines, one per numbered line, in the same order and in the form "<number>: <translated text>".
+        """
+
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "system": self.system_prompt,
+        }
+
+        response = requests.post(self.api_url, json=payload)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        output = response.json().get("response", "").strip()
+
+        matches = re.findall(r"<translation>(.*?)</translation>", output, re.DOTALL)
+        if not matches:
+            return None
+
+        # Split the answer back into one translation per numbered line
+        lines = {}
+        for line in matches[-1].strip().splitlines():
+            match = re.match(r"\s*(\d+)\s*[:.)]\s*(.*)", line)
+            if match:
+                lines[int(match.group(1))] = self.normalize_wide_letters(match.group(2).strip())
+        if sorted(lines) != list(range(1, len(texts) + 1)):
+            return None
+
+        return [type('TranslationResult', (object,), {'text': lines[i]})() for i in range(1, len(texts) + 1)]
+
     def normalize_wide_letters(self, text):
         result = []
         for char in text:
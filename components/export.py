@@ -0,0 +1,72 @@
+import os
+import zipfile
+import tempfile
+import threading
+
+from components import profiling
+from components.page import encode_png
+
+class PageArchive:
+    """
+    Zip or CBZ archive of translated pages built incrementally, one page at a time as soon as
+    it is finished.
+
+    PNG files are already compressed, so the entries are stored without compression. Without a
+    path, the archive is written to a spooled buffer that stays in memory up to `max_memory`
+    bytes and only then rolls over to a temporary file, so no copy of the chapter is staged in
+    the working directory.
+    """
+    def __init__(self, path=None, cbz=False, max_memory=256 * 1024 * 1024, directory=None):
+        """
+        Parameters:
+        - path (str): Optional file to write the archive to. Without it, the archive is kept in
+          a spooled buffer returned by `close`.
+        - cbz (bool): Name the archive as a comic book archive (.cbz) instead of .zip.
+        - max_memory (int): Bytes kept in memory before the spooled buffer rolls over to disk.
+        - directory (str): Directory of the file the spooled buffer rolls over to, e.g. the
+          workspace of the job, the system temporary directory by default.
+        """
+        self.path = path
+        self.file_name = os.path.basename(path) if path else f"translated.{'cbz' if cbz else 'zip'}"
+        self.buffer = open(path, 'wb') if path else tempfile.SpooledTemporaryFile(max_size=max_memory, dir=directory)
+        self.archive = zipfile.ZipFile(self.buffer, 'w', compression=zipfile.ZIP_STORED)
+        self.names = set()
+        self.lock = threading.Lock()
+
+    def add(self, name, data):
+        """
+        Adds a file to the archive. Names already in the archive get a numeric suffix.
+        """
+        with self.lock:
+            base, extension = os.path.splitext(name)
+            suffix = 1
+            while name in self.names:
+                name = f'{base}_{suffix}{extension}'
+                suffix += 1
+            self.names.add(name)
+            self.archive.writestr(name, data)
+        profiling.add_bytes(written=len(data))
+
+    def add_page(self, page):
+        """
+        Adds the translated image of a page as `{name}.png`.
+        """
+        self.add(f'{page.name}.png', encode_png(page.translated))
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        """
+        Writes the central directory of the archive.
+
+        Returns:
+        - file object: The archive rewound to its start, or None when it was written to a path.
+        """
+        with self.lock:
+            self.archive.close()
+            if self.path:
+                self.buffer.close()
+                return None
+            self.buffer.seek(0)
+            return self.buffer
@@ -1,10 +1,549 @@
 import os
+import sys
+import threading
+import collections
 
-def inpainting():
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from components import profiling
+from components.quantization import quantize_model
+
+# The LaMa code base is imported as the top-level `saicinpainting` package from bin/. It is only
+# imported when the checkpoint is loaded, so exported models run without the training stack
+INPAINTING_BIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+if INPAINTING_BIN_PATH not in sys.path:
+    sys.path.append(INPAINTING_BIN_PATH)
+
+DEFAULT_MODEL_PATH = 'components/image_inpainting/models/big-lama'
+
+# File extensions of the exported models, see `export_inpainting_model`
+EXPORTED_MODEL_EXTENSIONS = ('.pt',)
+
+def ceil_modulo(x, mod):
+    return x if x % mod == 0 else (x // mod + 1) * mod
+
+def pad_img_to_modulo(img, mod):
+    """
+    Pads a (C, H, W) array so both sides are a multiple of `mod`, as the LaMa evaluation code does.
     """
-    Runs the LaMa inpainting model on the segmentation results to inpaint the missing regions.
+    _, height, width = img.shape
+    return np.pad(img, ((0, 0), (0, ceil_modulo(height, mod) - height), (0, ceil_modulo(width, mod) - width)), mode='symmetric')
+
+class InpaintingDataset(Dataset):
+    """
+    Images and masks converted on access to the padded float tensors expected by LaMa, as the
+    LaMa evaluation dataset does.
+    """
+    def __init__(self, images, masks, pad_out_to_modulo=8):
+        self.images = images
+        self.masks = masks
+        self.pad_out_to_modulo = pad_out_to_modulo
+
+    def __len__(self):
+        return len(self.images)
+
+    def padded_shapes(self):
+        """
+        Returns the (height, width) of every image after padding.
+        """
+        return [
+            (ceil_modulo(image.shape[0], self.pad_out_to_modulo), ceil_modulo(image.shape[1], self.pad_out_to_modulo))
+            for image in self.images
+        ]
+
+    def __getitem__(self, index):
+        image, mask = self.images[index], self.masks[index]
+        height, width = image.shape[:2]
+        image = np.transpose(image, (2, 0, 1)).astype('float32') / 255
+        mask = (mask[None, ...] > 0).astype('float32')
+        return {
+            'index': index,
+            'image': torch.from_numpy(pad_img_to_modulo(image, self.pad_out_to_modulo)),
+            'mask': torch.from_numpy(pad_img_to_modulo(mask, self.pad_out_to_modulo)),
+            'unpad_to_size': torch.tensor([height, width]),
+        }
+
+def bucket_batches(shapes, batch_size):
+    """
+    Groups the indices of the items by shape and splits every group into batches, so each
+    batch can be stacked into one tensor.
+
+    Parameters:
+    - shapes (list of tuple): Shape of every item.
+    - batch_size (int): Maximum number of items per batch.
+
+    Returns:
+    - list of list of int: The batches of indices.
+    """
+    buckets = {}
+    for index, shape in enumerate(shapes):
+        buckets.setdefault(shape, []).append(index)
+    batch_size = max(1, batch_size)
+    return [indices[i:i + batch_size] for indices in buckets.values() for i in range(0, len(indices), batch_size)]
+
+class InpaintingModel:
+    """
+    LaMa inpainting model kept resident in memory, so the checkpoint is loaded and moved to
+    the device only once instead of on every run of bin/predict.py.
+    """
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, checkpoint='best.ckpt', device='cuda', pad_out_to_modulo=8,
+                 batch_size=1, num_workers=0, precision='fp32', keep_fp32=()):
+        """
+        Parameters:
+        - model_path (str): Directory with the training config.yaml and the models/ checkpoints.
+        - checkpoint (str): Checkpoint file name inside model_path/models.
+        - device (str): The device to use for inpainting ('cuda' or 'cpu').
+        - pad_out_to_modulo (int): Inputs are padded so both sides are a multiple of this value.
+        - batch_size (int): Images of the same padded shape inpainted per forward pass.
+        - num_workers (int): DataLoader worker processes preparing the next batch, 0 to prepare
+          the batches in the calling thread.
+        - precision (str): 'fp32', or 'int8' / 'bf16' to run the generator quantized on CPU (see
+          `quantize_model`).
+        - keep_fp32 (iterable of str): Generator layers left in float32 in int8 mode.
+        """
+        import yaml
+        from omegaconf import OmegaConf
+        from saicinpainting.training.trainers import load_checkpoint
+
+        self.device = torch.device(device)
+        self.pad_out_to_modulo = pad_out_to_modulo
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+        with open(os.path.join(model_path, 'config.yaml'), 'r') as f:
+            train_config = OmegaConf.create(yaml.safe_load(f))
+        train_config.training_model.predict_only = True
+        train_config.visualizer.kind = 'noop'
+
+        checkpoint_path = os.path.join(model_path, 'models', checkpoint)
+        self.model = load_checkpoint(train_config, checkpoint_path, strict=False, map_location='cpu')
+        self.model.freeze()
+        self.model.to(self.device)
+        self.model.generator = quantize_model(self.model.generator, precision, keep_fp32)
+
+    def forward(self, image, mask):
+        """
+        Runs the model on a batch of padded image and mask tensors on the model device.
+
+        Returns:
+        - torch.Tensor: The inpainted images of shape (N, 3, H, W) with values in [0, 1].
+        """
+        return self.model({'image': image, 'mask': mask})['inpainted']
+
+    def inpaint(self, image, mask):
+        """
+        Inpaints the masked regions of a single image.
+
+        Parameters:
+        - image (np.ndarray): RGB image of shape (H, W, 3) and dtype uint8.
+        - mask (np.ndarray): Mask of shape (H, W); non-zero pixels are inpainted.
+
+        Returns:
+        - np.ndarray: The inpainted RGB image of shape (H, W, 3) and dtype uint8.
+        """
+        return self.inpaint_batch([image], [mask])[0]
+
+    def inpaint_batch(self, images, masks, batch_size=None, num_workers=None, max_pixels=None):
+        """
+        Inpaints a list of images with their corresponding masks.
+
+        The images are grouped by padded shape and every group is run through the model in
+        batches of `batch_size`. With `num_workers`, a DataLoader prepares the next batch in
+        worker processes while the current one runs on the device.
+
+        With `max_pixels`, larger images are inpainted at a reduced resolution and the fill is
+        upscaled and blended into the full resolution image inside the dilated mask only (see
+        `downscale_to_budget` and `blend_upscaled`).
+
+        Parameters:
+        - images (list of np.ndarray): RGB images of shape (H, W, 3) and dtype uint8.
+        - masks (list of np.ndarray): Masks of shape (H, W); non-zero pixels are inpainted.
+        - batch_size (int): Overrides the batch size of the model for this call.
+        - num_workers (int): Overrides the DataLoader workers of the model for this call.
+        - max_pixels (int): Pixel budget of the images run through the model, None to always
+          inpaint at full resolution.
+
+        Returns:
+        - list of np.ndarray: The inpainted RGB images, each with the size of its input.
+        """
+        if not images:
+            return []
+        if max_pixels:
+            originals = list(zip(images, masks))
+            images, masks, scales = zip(*[downscale_to_budget(image, mask, max_pixels) for image, mask in originals])
+        dataset = InpaintingDataset(images, masks, self.pad_out_to_modulo)
+        loader = DataLoader(
+            dataset,
+            batch_sampler=bucket_batches(dataset.padded_shapes(), batch_size or self.batch_size),
+            num_workers=self.num_workers if num_workers is None else num_workers,
+            pin_memory=self.device.type == 'cuda',
+        )
+
+        results = [None] * len(images)
+        for batch in loader:
+            indices = batch.pop('index').tolist()
+            unpad_to_size = batch.pop('unpad_to_size').tolist()
+            batch = {key: value.to(self.device, non_blocking=True) for key, value in batch.items()}
+            with torch.inference_mode(), profiling.measure('inpainting', section='model', pages=0):
+                inpainted = self.forward(batch['image'], batch['mask']).permute(0, 2, 3, 1).cpu().numpy()
+            for index, (height, width), result in zip(indices, unpad_to_size, inpainted):
+                results[index] = np.clip(result[:height, :width] * 255, 0, 255).astype('uint8')
+
+        if max_pixels:
+            results = [
+                blend_upscaled(image, mask, result, scale) if scale < 1 else result
+                for (image, mask), result, scale in zip(originals, results, scales)
+            ]
+        return results
+
+    def inpaint_regions(self, image, mask, boxes, batch_size=None, num_workers=None, max_pixels=None):
+        """
+        Inpaints only the given regions of an image and pastes the results back into a copy.
+
+        Parameters:
+        - image (np.ndarray): RGB image of shape (H, W, 3) and dtype uint8.
+        - mask (np.ndarray): Mask of shape (H, W); non-zero pixels are inpainted.
+        - boxes (list of (x0, y0, x1, y1)): Regions to inpaint, covering every masked pixel.
+        - batch_size, num_workers, max_pixels: See `inpaint_batch`.
+
+        Returns:
+        - np.ndarray: The inpainted RGB image.
+        """
+        result = image.copy()
+        crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+        mask_crops = [mask[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+        for (x0, y0, x1, y1), inpainted in zip(boxes, self.inpaint_batch(crops, mask_crops, batch_size, num_workers, max_pixels)):
+            result[y0:y1, x0:x1] = inpainted
+        return result
+
+class ExportedInpaintingModel(InpaintingModel):
+    """
+    LaMa generator exported by `export_inpainting_model`, run with TorchScript instead of the
+    training stack, which is never imported.
+
+    It takes the same inputs and offers the same methods as InpaintingModel.
+    """
+    def __init__(self, path, device='cpu', pad_out_to_modulo=8, batch_size=1, num_workers=0):
+        """
+        Parameters:
+        - path (str): The exported model, a .pt TorchScript file.
+        - device, pad_out_to_modulo, batch_size, num_workers: See InpaintingModel.
+        """
+        self.device = torch.device(device)
+        self.pad_out_to_modulo = pad_out_to_modulo
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+        model = torch.jit.load(path, map_location=self.device).eval()
+        if self.device.type == 'cpu':
+            # Fold the weights into the graph and fuse the operations for CPU inference
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+        self.model = model
+
+    def forward(self, image, mask):
+        return self.model(image, mask)
+
+def downscale_to_budget(image, mask, max_pixels):
+    """
+    Downscales an image and its mask so the image has at most `max_pixels` pixels.
+
+    The mask is resized with area interpolation and every pixel touching the text is kept, so
+    the reduced mask still covers all the text.
+
+    Returns:
+    - tuple: The image, the mask and the scale factor applied (1.0 when the image fits).
     """
+    height, width = image.shape[:2]
+    if height * width <= max_pixels:
+        return image, mask, 1.0
+    scale = (max_pixels / (height * width)) ** 0.5
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small_image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    small_mask = cv2.resize((mask > 0).astype(np.uint8) * 255, size, interpolation=cv2.INTER_AREA)
+    return small_image, (small_mask > 0).astype(np.uint8) * 255, scale
+
+def blend_upscaled(image, mask, inpainted, scale):
+    """
+    Upscales an image inpainted at a reduced resolution and blends it into the full resolution
+    image inside the mask dilated by about one reduced pixel, keeping the original pixels
+    everywhere else.
+
+    Parameters:
+    - image (np.ndarray): Full resolution RGB image.
+    - mask (np.ndarray): Full resolution mask; non-zero pixels were inpainted.
+    - inpainted (np.ndarray): RGB image inpainted at the reduced resolution.
+    - scale (float): Scale factor of the reduced resolution.
+
+    Returns:
+    - np.ndarray: The full resolution inpainted image.
+    """
+    height, width = image.shape[:2]
+    upscaled = cv2.resize(inpainted, (width, height), interpolation=cv2.INTER_CUBIC)
+    radius = int(np.ceil(1 / scale))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    blend_mask = cv2.dilate((mask > 0).astype(np.uint8), kernel) > 0
+    result = image.copy()
+    result[blend_mask] = upscaled[blend_mask]
+    return result
+
+def align_region(region, modulo, width, height):
+    """
+    Grows a region so both sides are multiples of `modulo`, as far as the image allows, shifting
+    it back inside the image when it would cross the border.
+
+    Returns:
+    - tuple: The region (x0, y0, x1, y1).
+    """
+    def grow(start, end, limit):
+        size = min(ceil_modulo(end - start, modulo), limit)
+        start = max(0, min(start, limit - size))
+        return start, start + size
+
+    x0, y0, x1, y1 = region
+    x0, x1 = grow(x0, x1, width)
+    y0, y1 = grow(y0, y1, height)
+    return x0, y0, x1, y1
+
+def mask_regions(mask, blocks=None, margin=32):
+    """
+    Computes the regions to inpaint around the text of a page: the boxes of the mask
+    components, expanded by a context margin and merged while they overlap.
+
+    Parameters:
+    - mask (np.ndarray): Mask of shape (H, W); non-zero pixels are inpainted.
+    - blocks: Optional boxes of the mask components (a BlockSet or (x, y, width, height) tuples),
+      computed from the mask when missing.
+    - margin (int): Context kept around every component, in pixels.
+
+    Returns:
+    - list of (x0, y0, x1, y1): The regions, clipped to the image.
+    """
+    height, width = mask.shape[:2]
+    if blocks is None:
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), 8, cv2.CV_32S)
+        blocks = [tuple(stats[i, :4]) for i in range(1, num_labels)]
+
+    regions = [
+        [max(0, x - margin), max(0, y - margin), min(width, x + w + margin), min(height, y + h + margin)]
+        for x, y, w, h in blocks
+    ]
+
+    # Merge overlapping regions until none overlap
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(int(v) for v in region) for region in regions]
+
+def load_inpainting_model(device, model_path=DEFAULT_MODEL_PATH, batch_size=1, num_workers=0, precision='fp32', keep_fp32=()):
+    """
+    Loads and returns the LaMa inpainting model on the specified device.
+
+    Parameters:
+    - device (str): The device to use for inpainting ('cuda' or 'cpu').
+    - model_path (str): Directory of the big-lama model, or a model exported by
+      `export_inpainting_model` (.pt file).
+    - batch_size (int): Default number of images of the same padded shape per forward pass.
+    - num_workers (int): Default DataLoader worker processes preparing the batches.
+    - precision (str): 'fp32', 'int8' or 'bf16', the last two on CPU and with the checkpoint only.
+    - keep_fp32 (iterable of str): Generator layers left in float32 in int8 mode.
+
+    Returns:
+    - InpaintingModel: The resident inpainting model.
+    """
+    if model_path.endswith(EXPORTED_MODEL_EXTENSIONS):
+        if precision != 'fp32':
+            raise ValueError(f'{precision} inference requires the big-lama checkpoint, not an exported model')
+        return ExportedInpaintingModel(model_path, device=device, batch_size=batch_size, num_workers=num_workers)
+    return InpaintingModel(model_path=model_path, device=device, batch_size=batch_size, num_workers=num_workers,
+                           precision=precision, keep_fp32=keep_fp32)
+
+def export_inpainting_model(output_path, model_path=DEFAULT_MODEL_PATH, checkpoint='best.ckpt', sample_size=256):
+    """
+    Exports the LaMa generator of a checkpoint to TorchScript for inference without the
+    training stack.
+
+    The model is traced on CPU with the JITWrapper of bin/to_jit.py. The height and width of
+    the inputs are dynamic (multiples of 8). The exported model is checked against the
+    checkpoint on an input of another size.
+
+    Parameters:
+    - output_path (str): .pt file the model is written to.
+    - model_path (str): Directory of the big-lama model.
+    - checkpoint (str): Checkpoint file name inside model_path/models.
+    - sample_size (int): Side of the random input used for tracing.
+
+    Returns:
+    - float: The maximum absolute difference between the exported model and the checkpoint.
+    """
+    from to_jit import JITWrapper
+
+    if not output_path.endswith(EXPORTED_MODEL_EXTENSIONS):
+        raise ValueError(f'Unknown export format of {output_path}, expected one of {EXPORTED_MODEL_EXTENSIONS}')
+
+    model = InpaintingModel(model_path=model_path, checkpoint=checkpoint, device='cpu')
+    wrapper = JITWrapper(model.model).eval()
+    image = torch.rand(1, 3, sample_size, sample_size)
+    mask = (torch.rand(1, 1, sample_size, sample_size) > 0.8).float()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.jit.trace(wrapper, (image, mask), strict=False, check_trace=False).save(output_path)
+
+    # Check the exported model on another size, which also checks the dynamic axes
+    exported = ExportedInpaintingModel(output_path, device='cpu')
+    image = torch.rand(1, 3, sample_size + 64, sample_size - 32)
+    mask = (torch.rand(1, 1, sample_size + 64, sample_size - 32) > 0.8).float()
+    with torch.no_grad():
+        return (wrapper(image, mask) - exported.forward(image, mask)).abs().max().item()
+
+def classical_inpaint(image, mask, flat_threshold=4.0, texture_threshold=24.0, method='telea', ring_width=4):
+    """
+    Fills the text components lying on a flat or smooth background without the neural model.
+
+    Every connected component of the mask is classified by the standard deviation of the ring
+    of unmasked pixels around it: components whose ring is flat are filled with its median
+    color, smooth ones are inpainted with `cv2.inpaint`, and the textured ones are left in
+    the returned mask for LaMa.
+
+    Parameters:
+    - image (np.ndarray): RGB image of shape (H, W, 3) and dtype uint8.
+    - mask (np.ndarray): Mask of shape (H, W); non-zero pixels are inpainted.
+    - flat_threshold (float): Maximum ring standard deviation of a solid fill.
+    - texture_threshold (float): Maximum ring standard deviation of a classical inpainting.
+    - method (str): 'telea' or 'ns', the algorithm of `cv2.inpaint`.
+    - ring_width (int): Width in pixels of the ring around every component.
+
+    Returns:
+    - tuple: The partially inpainted image, the mask of the components left for LaMa and the
+      number of components that took each path ('solid', 'classical' and 'lama').
+    """
+    flags = {'telea': cv2.INPAINT_TELEA, 'ns': cv2.INPAINT_NS}
+    if method not in flags:
+        raise ValueError(f'Unknown classical inpainting method {method}')
+
+    height, width = mask.shape[:2]
+    binary = (mask > 0).astype(np.uint8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary, 8, cv2.CV_32S)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * ring_width + 1, 2 * ring_width + 1))
+
+    result = image.copy()
+    remaining = np.zeros_like(binary)
+    counts = {'solid': 0, 'classical': 0, 'lama': 0}
+    for label in range(1, num_labels):
+        x, y, w, h = stats[label, :4]
+        x0, y0 = max(0, x - ring_width), max(0, y - ring_width)
+        x1, y1 = min(width, x + w + ring_width), min(height, y + h + ring_width)
+        component = (labels[y0:y1, x0:x1] == label).astype(np.uint8)
+        ring = (cv2.dilate(component, kernel) > 0) & (binary[y0:y1, x0:x1] == 0)
+        ring_pixels = image[y0:y1, x0:x1][ring]
+        deviation = ring_pixels.std(axis=0).max() if len(ring_pixels) else float('inf')
+
+        crop = result[y0:y1, x0:x1]
+        if deviation <= flat_threshold:
+            crop[component > 0] = np.median(ring_pixels, axis=0).astype(np.uint8)
+            counts['solid'] += 1
+        elif deviation <= texture_threshold:
+            # Every text pixel of the window is unknown to cv2.inpaint, so the text of the
+            # neighbouring components is not smeared into the fill; only this component is kept
+            inpainted = cv2.inpaint(np.ascontiguousarray(crop), binary[y0:y1, x0:x1], 3, flags[method])
+            crop[component > 0] = inpainted[component > 0]
+            counts['classical'] += 1
+        else:
+            remaining[y0:y1, x0:x1][component > 0] = 255
+            counts['lama'] += 1
+    return result, remaining, counts
+
+# Guards the shared counters of the inpainting paths updated by concurrent jobs
+_paths_lock = threading.Lock()
+
+def inpainting(pages, model, mode='full', region_margin=32, max_region_fraction=0.5, region_modulo=64, batch_size=None, num_workers=None,
+               max_pixels=None, flat_threshold=4.0, texture_threshold=24.0, classical_method='telea', paths=None):
+    """
+    Runs the LaMa inpainting model on the segmented pages to inpaint the text regions.
+
+    Parameters:
+    - pages (list of Page): Pages with their image and text mask.
+    - model (InpaintingModel): The resident inpainting model.
+    - mode (str): 'full' inpaints the whole page. 'regions' only inpaints the regions around
+      the text blocks and pastes them back, so the cost follows the text area. 'tiered' first
+      fills the text on flat or smooth backgrounds without the model (see `classical_inpaint`)
+      and inpaints the remaining text blocks as in 'regions'.
+    - region_margin (int): Context in pixels kept around every text block in 'regions' mode.
+    - max_region_fraction (float): In 'regions' mode, pages whose regions cover more than this
+      fraction of the page are inpainted whole, which is then cheaper.
+    - region_modulo (int): The regions are grown to multiples of this size, so crops of similar
+      size share a padded shape and can be batched together.
+    - batch_size (int): Images or regions of the same padded shape per forward pass, the
+      model's default when None.
+    - num_workers (int): DataLoader workers preparing the batches, the model's default when None.
+    - max_pixels (int): Resolution budget. Pages (or regions) larger than this are inpainted
+      at a reduced resolution and the fill is blended back at full resolution, trading some
+      quality of the fill for speed on high resolution scans. None keeps the full resolution.
+    - flat_threshold, texture_threshold, classical_method: Routing of the text components in
+      'tiered' mode, see `classical_inpaint`.
+    - paths (collections.Counter): Optional counter updated with the number of text components
+      that took each path in 'tiered' mode, e.g. to report the totals of a whole run.
+
+    Returns:
+    - collections.Counter: The number of text components that took each path in 'tiered' mode,
+      empty otherwise.
+    """
+    if mode not in ('full', 'regions', 'tiered'):
+        raise ValueError(f'Unknown inpainting mode {mode}')
+
+    # Every page is inpainted whole or as crops of its text regions, and the images of all the
+    # pages go through a single `inpaint_batch` call, so the crops of different pages share
+    # batches and the DataLoader workers are started once
+    counts = collections.Counter()
+    targets, images, masks = [], [], []
+    for page in pages:
+        image, mask, blocks = page.image, page.mask, page.blocks
+        if mode == 'tiered':
+            image, mask, page_counts = classical_inpaint(image, mask, flat_threshold, texture_threshold, classical_method)
+            counts.update(page_counts)
+            blocks = None
+            if not mask.any():
+                page.inpainted = image
+                continue
+        if mode in ('regions', 'tiered'):
+            regions = mask_regions(mask, blocks, margin=region_margin)
+            area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+            if area <= max_region_fraction * mask.size:
+                page.inpainted = image.copy()
+                height, width = mask.shape[:2]
+                for region in regions:
+                    x0, y0, x1, y1 = align_region(region, region_modulo, width, height)
+                    targets.append((page, (x0, y0, x1, y1)))
+                    images.append(image[y0:y1, x0:x1])
+                    masks.append(mask[y0:y1, x0:x1])
+                continue
+        targets.append((page, None))
+        images.append(image)
+        masks.append(mask)
 
-    current_directory = os.getcwd()
+    results = model.inpaint_batch(images, masks, batch_size, num_workers, max_pixels)
+    for (page, region), result in zip(targets, results):
+        if region is None:
+            page.inpainted = result
+        else:
+            # Overlapping crops also inpainted the masked pixels they share
+            x0, y0, x1, y1 = region
+            page.inpainted[y0:y1, x0:x1] = result
 
-    os.system(f'python {current_directory}/components/image_inpainting/bin/predict.py model.path={current_directory}/components/image_inpainting/models/big-lama indir={current_directory}/prediction/segmentation outdir={current_directory}/prediction/inpainting/')
\ No newline at end of file
+    if paths is not None:
+        with _paths_lock:
+            paths.update(counts)
+    return counts
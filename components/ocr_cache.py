@@ -0,0 +1,37 @@
+import hashlib
+
+from components.cache import PersistentCache
+
+class OcrCache(PersistentCache):
+    """
+    Content-addressed cache of OCR results stored in a SQLite database.
+
+    Entries are keyed by a hash of the crop pixels and the OCR engine and model, so re-running
+    a chapter only recognizes the blocks whose crops actually changed.
+    """
+    table = 'ocr'
+
+    def __init__(self, path='cache/ocr.sqlite', max_entries=100000, memory_entries=4096):
+        super().__init__(path, max_entries=max_entries, memory_entries=memory_entries)
+
+    def key(self, crop, ocr_model, ocr_type):
+        """
+        Builds the cache key of a cropped block for the given OCR model.
+        """
+        digest = hashlib.sha256()
+        digest.update(ocr_model_id(ocr_model, ocr_type).encode('utf-8'))
+        digest.update(f'{crop.shape}{crop.dtype}'.encode('utf-8'))
+        digest.update(crop.tobytes())
+        return digest.hexdigest()
+
+def ocr_model_id(ocr_model, ocr_type):
+    """
+    Returns a string identifying the OCR engine and model in the cache keys.
+    """
+    if ocr_type == 'manga_ocr':
+        name = getattr(ocr_model.model, 'name_or_path', '')
+    elif ocr_type == 'easyocr':
+        name = ','.join(getattr(ocr_model, 'lang_list', []))
+    else:
+        name = ''
+    return f'{ocr_type}:{name}'
@@ -0,0 +1,153 @@
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from components import profiling
+
+class Page:
+    """
+    A manga page flowing through the pipeline.
+
+    Every stage reads its inputs from and writes its results to the page in memory, so the
+    decoded rasters are handed from one stage to the next without PNG round-trips. Writing
+    the intermediate results to disk is only done on request through `save`.
+
+    Attributes:
+    - file_name (str): Original file name of the page.
+    - name (str): File name without extension, used to name the outputs.
+    - image (np.ndarray): RGB page of shape (H, W, 3) and dtype uint8.
+    - mask (np.ndarray): Text mask of shape (H, W) and dtype uint8 (0 or 255).
+    - blocks (BlockSet): Text blocks detected on the mask.
+    - texts (list of str): Recognized text of each block.
+    - translations (list of str): Translated text of each block.
+    - inpainted (np.ndarray): RGB page with the text removed.
+    - translated (np.ndarray): RGB page with the translated text injected.
+    """
+    def __init__(self, file_name, image):
+        self.file_name = file_name
+        self.name, _ = os.path.splitext(file_name)
+        self.image = image
+        self.mask = None
+        self.blocks = None
+        self.texts = []
+        self.translations = []
+        self.inpainted = None
+        self.translated = None
+
+    @classmethod
+    def from_file(cls, file):
+        """
+        Decodes an uploaded file (UploadedFile object or any file-like object with a `name`).
+
+        Parameters:
+        - file: The file to decode.
+
+        Returns:
+        - Page: The decoded page.
+        """
+        profiling.add_bytes(read=file.seek(0, os.SEEK_END))
+        file.seek(0)
+        image = np.array(Image.open(file).convert('RGB'))
+        return cls(os.path.basename(file.name), image)
+
+    def save(self, directory='prediction'):
+        """
+        Writes the available intermediate results as PNG files, using the directory layout
+        of the original file-based pipeline. Used for debugging and checkpointing.
+
+        Parameters:
+        - directory (str): Root directory of the saved results.
+        """
+        for path, image in self.intermediate_images():
+            path = os.path.join(directory, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_png(path, image)
+
+    def intermediate_images(self):
+        """
+        Returns the available intermediate results with their path relative to the directory
+        given to `save`, e.g. to add them to an archive.
+
+        Returns:
+        - list of (str, np.ndarray): The relative PNG path and the image of every result.
+        """
+        images = [
+            (f'segmentation/{self.name}/{self.name}.png', self.image),
+            (f'segmentation/{self.name}/{self.name}_mask.png', self.mask),
+            (f'inpainting/{self.name}/{self.name}_mask.png', self.inpainted),
+            (f'translated/{self.name}.png', self.translated),
+        ]
+        return [(path, image) for path, image in images if image is not None]
+
+    def save_translated(self, directory):
+        """
+        Writes the translated page as `{name}.png` inside the given directory.
+
+        Parameters:
+        - directory (str): Output directory.
+
+        Returns:
+        - str: Path of the written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.name}.png')
+        write_png(path, self.translated)
+        return path
+
+def unique_names(names):
+    """
+    Makes file names unique by adding a numeric suffix to the repeated ones, so pages with the
+    same file name do not overwrite each other's outputs.
+
+    Returns:
+    - list of str: The names in the same order, e.g. ['a.png', 'a.png'] -> ['a.png', 'a_1.png'].
+    """
+    seen = set(names)
+    used = set()
+    unique = []
+    for name in names:
+        if name in used:
+            base, extension = os.path.splitext(name)
+            suffix = 1
+            while f'{base}_{suffix}{extension}' in seen:
+                suffix += 1
+            name = f'{base}_{suffix}{extension}'
+            seen.add(name)
+        used.add(name)
+        unique.append(name)
+    return unique
+
+def deduplicate_pages(pages):
+    """
+    Renames the pages sharing a file name (see `unique_names`).
+    """
+    for page, file_name in zip(pages, unique_names([page.file_name for page in pages])):
+        if file_name != page.file_name:
+            page.file_name = file_name
+            page.name, _ = os.path.splitext(file_name)
+    return pages
+
+def write_png(path, image):
+    """
+    Writes an RGB or grayscale uint8 array as a PNG file.
+    """
+    data = encode_png(image)
+    with open(path, 'wb') as f:
+        f.write(data)
+    profiling.add_bytes(written=len(data))
+
+def encode_png(image):
+    """
+    Encodes an RGB or grayscale uint8 array as PNG in memory.
+
+    Returns:
+    - bytes: The PNG file contents.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    ok, data = cv2.imencode('.png', image)
+    if not ok:
+        raise ValueError('Could not encode the image as PNG')
+    return data.tobytes()
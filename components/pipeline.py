@@ -0,0 +1,477 @@
+import io
+import os
+import sys
+import queue
+import zipfile
+import threading
+import contextvars
+
+import torch
+from fastai.vision import load_learner, defaults
+import deepl
+from manga_ocr import MangaOcr
+import easyocr
+
+from components import profiling
+from components.quantization import quantize_model
+from components.page import Page, deduplicate_pages, unique_names
+from components.text_detection.text_segmentation import text_segmentation_batch
+from components.text_block_detection import block_detection
+from components.text_recognition import ocr_batch
+from components.text_translation import translate_page_texts, translate_texts
+from components.image_inpainting.inpainting import inpainting, load_inpainting_model
+from components.text_injection import text_injection, text_injection_parallel
+from components.cust_translators.ollama import OllamaTranslator
+from components.cust_translators.googletrans import GoogleTrans
+
+# File extensions recognised as manga pages or page archives
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+ARCHIVE_EXTENSIONS = ('.zip', '.cbz')
+
+class PageFile:
+    """
+    Page image on disk or inside an archive with a `name` attribute, mimicking Streamlit's
+    UploadedFile so that pages read from disk can be fed to the same stage functions.
+
+    The bytes are only read when the file is first accessed and are released by `close`, so
+    listing a chapter does not load its pages in memory.
+    """
+    def __init__(self, name, path, member=None):
+        """
+        Parameters:
+        - name (str): File name of the page.
+        - path (str): Image file, or archive holding the page.
+        - member (str): Name of the page inside the archive, None for an image file.
+        """
+        self.name = name
+        self.path = path
+        self.member = member
+        self.buffer = None
+
+    def __getattr__(self, attribute):
+        # Only called for the file methods (read, seek, tell...), which open the page first
+        if attribute.startswith('__') or attribute == 'buffer':
+            raise AttributeError(attribute)
+        if self.buffer is None:
+            if self.member is None:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+            else:
+                with zipfile.ZipFile(self.path) as archive:
+                    data = archive.read(self.member)
+            self.buffer = io.BytesIO(data)
+        return getattr(self.buffer, attribute)
+
+    def close(self):
+        """
+        Releases the bytes of the page, which are read again on the next access.
+        """
+        self.buffer = None
+
+def decode_page(file):
+    """
+    Decodes a page, releasing the bytes of a PageFile once it is decoded.
+    """
+    page = Page.from_file(file)
+    if isinstance(file, PageFile):
+        file.close()
+    return page
+
+def load_pages(path):
+    """
+    Collects the pages to process from a directory, an archive or a single image.
+
+    Parameters:
+    - path (str): Directory of images, .zip/.cbz archive, or a single image file.
+
+    Returns:
+    - list of PageFile: The pages sorted by file name, read lazily. Repeated file names, e.g.
+      from different folders of an archive, get a numeric suffix.
+    """
+    pages = []
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            f = os.path.join(path, filename)
+            if os.path.isfile(f):
+                pages.extend(load_pages(f))
+    elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+        with zipfile.ZipFile(path) as archive:
+            for member in sorted(archive.namelist()):
+                if member.lower().endswith(IMAGE_EXTENSIONS):
+                    pages.append(PageFile(os.path.basename(member), path, member))
+    elif path.lower().endswith(IMAGE_EXTENSIONS):
+        pages.append(PageFile(os.path.basename(path), path))
+    for page, name in zip(pages, unique_names([page.name for page in pages])):
+        page.name = name
+    return pages
+
+def load_segmentation_model(segmentation_device, model_name, precision='fp32', keep_fp32=()):
+    """
+    Loads and returns the text segmentation model on the specified device.
+
+    Parameters:
+    - segmentation_device (str): The device to use for the model ('cuda' or 'cpu').
+    - model_name (str): File name of the model inside components/text_detection/models.
+    - precision (str): 'fp32', or 'int8' / 'bf16' to run the U-Net quantized on CPU (see
+      `quantize_model`).
+    - keep_fp32 (iterable of str): U-Net layers left in float32 in int8 mode.
+
+    Returns:
+    - The loaded text segmentation model.
+    """
+    # The pickled learner references modules from the text detection directory
+    if './components/text_detection' not in sys.path:
+        sys.path.append('./components/text_detection')
+
+    # fastai places the learner on its global default device, which is only changed while
+    # loading so models of other jobs can be loaded on other devices at the same time
+    with _segmentation_device_lock:
+        previous_device = defaults.device
+        defaults.device = torch.device(segmentation_device)
+        try:
+            learner = load_learner('.', f'components/text_detection/models/{model_name}')
+        finally:
+            defaults.device = previous_device
+    learner.model = quantize_model(learner.model, precision, keep_fp32)
+    return learner
+
+_segmentation_device_lock = threading.Lock()
+
+def load_ocr(ocr_device, ocr_type, ocr_lang=None):
+    """
+    Initializes and returns the OCR model for the specified device.
+
+    Parameters:
+    - ocr_device (str): The device to use ('cuda' or 'cpu').
+    - ocr_type (str): 'manga_ocr' or 'easyocr'.
+    - ocr_lang (list of str): Source languages, only used by easyocr.
+
+    Returns:
+    - An instance of the selected OCR model.
+    """
+    use_gpu = ocr_device == 'cuda'
+    if ocr_type == 'manga_ocr':
+        return MangaOcr(force_cpu=not use_gpu)
+    elif ocr_type == 'easyocr':
+        return easyocr.Reader(ocr_lang, gpu=use_gpu)
+    raise ValueError(f'Unknown OCR type {ocr_type}')
+
+def load_translator(provider, deepl_key=None, ollama_model=None):
+    """
+    Initializes the translator for the selected provider.
+
+    Parameters:
+    - provider (str): 'DeepL', 'Ollama' or 'GoogleTrans'.
+    - deepl_key (str): DeepL API key, only used by DeepL.
+    - ollama_model (str): Ollama model name, only used by Ollama.
+
+    Returns:
+    - An object exposing a `translate_text` method.
+    """
+    if provider == 'DeepL':
+        return deepl.Translator(deepl_key)
+    elif provider == 'Ollama':
+        return OllamaTranslator(model=ollama_model) if ollama_model else OllamaTranslator()
+    elif provider == 'GoogleTrans':
+        return GoogleTrans()
+    raise ValueError(f'Unknown translation provider {provider}')
+
+def run_pipeline(files, segmentation_model, ocr_model, ocr_type, translator, target_language,
+                 inpainting_model, font, font_size, dilation_iterations=3, segmentation_batch_size=4, ocr_batch_size=16, translation_workers=1,
+                 translation_batch=False, pages_per_request=1, translation_cache=None, ocr_cache=None,
+                 segmentation_tile_size=None, segmentation_tile_overlap=128, inpainting_options=None, injection_workers=1,
+                 save_dir=None, output_dir=None, archive=None):
+    """
+    Runs every stage of the translation pipeline over a list of pages.
+
+    Parameters:
+    - files: Pages to translate (UploadedFile or PageFile objects).
+    - segmentation_model: Loaded text segmentation learner.
+    - ocr_model, ocr_type: Loaded OCR model and its type.
+    - translator: Object exposing a `translate_text` method.
+    - target_language (str): Target language code (e.g. 'EN-US').
+    - inpainting_model (InpaintingModel): Resident LaMa inpainting model.
+    - font (str): Font file name inside the text_fonts directory.
+    - font_size (int): Maximum font size for the injected text.
+    - dilation_iterations (int): Mask dilation iterations for block detection.
+    - segmentation_batch_size (int): Pages per text segmentation forward pass.
+    - segmentation_tile_size (int): Pages larger than this are segmented in overlapping tiles.
+    - segmentation_tile_overlap (int): Overlap between neighbouring segmentation tiles.
+    - ocr_batch_size (int): Text blocks recognized per OCR forward pass.
+    - ocr_cache (OcrCache): Optional persistent cache of OCR results.
+    - translation_workers (int): Maximum number of translation requests in flight.
+    - translation_batch (bool): Translate all the texts of `pages_per_request` pages with a single request.
+    - pages_per_request (int): Pages whose texts are joined in one batch translation request.
+    - translation_cache (TranslationCache): Optional persistent cache of translations.
+    - inpainting_options (dict): Optional keyword arguments of `inpainting`, e.g. {'mode': 'regions'}.
+    - injection_workers (int): Worker processes rendering the translated pages in parallel.
+    - save_dir (str): Optional directory where the intermediate results of every page are saved.
+    - output_dir (str): Optional directory where the translated pages are written as PNG files.
+    - archive (PageArchive): Optional archive receiving the translated pages as they are finished.
+
+    Returns:
+    - list of Page: The processed pages, holding the translated images in memory.
+    """
+    total_files = len(files)
+
+    with profiling.measure('segmentation', pages=total_files):
+        pages = deduplicate_pages([decode_page(file) for file in files])
+        text_segmentation_batch(
+            pages,
+            learner=segmentation_model,
+            batch_size=segmentation_batch_size,
+            tile_size=segmentation_tile_size,
+            tile_overlap=segmentation_tile_overlap,
+        )
+        torch.cuda.empty_cache()
+
+    with profiling.measure('block detection', pages=total_files):
+        for page in pages:
+            block_detection(page, dilation_iterations=dilation_iterations)
+
+    with profiling.measure('ocr', pages=total_files):
+        ocr_batch(pages, ocr_model, ocr_type, batch_size=ocr_batch_size, cache=ocr_cache)
+        torch.cuda.empty_cache()
+
+    with profiling.measure('translation', pages=total_files):
+        translations = translate_page_texts(
+            [page.texts for page in pages],
+            target_language=target_language,
+            translator=translator,
+            pages_per_request=pages_per_request if translation_batch else 1,
+            max_workers=translation_workers,
+            batch=translation_batch,
+            cache=translation_cache,
+        )
+        for page, page_translations in zip(pages, translations):
+            page.translations = page_translations
+
+    with profiling.measure('inpainting', pages=total_files):
+        inpainting(pages, inpainting_model, **(inpainting_options or {}))
+        torch.cuda.empty_cache()
+
+    with profiling.measure('text injection', pages=total_files):
+        text_injection_parallel(pages, font, font_size, processes=injection_workers, output_dir=output_dir,
+                                archive=archive)
+
+    if save_dir is not None:
+        for page in pages:
+            page.save(save_dir)
+
+    return pages
+
+# Number of workers of each stage in the streaming pipeline. The model stages keep a single
+# worker, since they share one model instance; translation mostly waits on the network.
+DEFAULT_STAGE_WORKERS = {
+    'segmentation': 1,
+    'block detection': 1,
+    'ocr': 1,
+    'translation': 4,
+    'inpainting': 1,
+    'text injection': 1,
+}
+
+def page_stages(segmentation_model, ocr_model, ocr_type, translator, target_language, inpainting_model,
+                font, font_size, dilation_iterations=3, segmentation_tile_size=None, segmentation_tile_overlap=128,
+                ocr_batch_size=16, ocr_cache=None, translation_workers=1, translation_batch=False, translation_cache=None,
+                inpainting_options=None):
+    """
+    Builds the pipeline stages as functions processing one page each, for the streaming pipeline.
+    The parameters are the ones of `run_pipeline`.
+
+    Returns:
+    - list of (str, callable): The name and function of every stage, in order. The first
+      function receives an uploaded file and every function returns the Page object.
+    """
+    def segmentation(file):
+        page = decode_page(file)
+        text_segmentation_batch(
+            [page],
+            learner=segmentation_model,
+            batch_size=1,
+            tile_size=segmentation_tile_size,
+            tile_overlap=segmentation_tile_overlap,
+        )
+        return page
+
+    def detection(page):
+        block_detection(page, dilation_iterations=dilation_iterations)
+        return page
+
+    def recognition(page):
+        ocr_batch([page], ocr_model, ocr_type, batch_size=ocr_batch_size, cache=ocr_cache)
+        return page
+
+    def translation(page):
+        page.translations = translate_texts(
+            page.texts,
+            target_language=target_language,
+            translator=translator,
+            max_workers=translation_workers,
+            batch=translation_batch,
+            cache=translation_cache,
+        )
+        return page
+
+    def inpaint(page):
+        inpainting([page], inpainting_model, **(inpainting_options or {}))
+        return page
+
+    def injection(page):
+        text_injection(page, font=font, fontSize=font_size)
+        return page
+
+    return [
+        ('segmentation', segmentation),
+        ('block detection', detection),
+        ('ocr', recognition),
+        ('translation', translation),
+        ('inpainting', inpaint),
+        ('text injection', injection),
+    ]
+
+def stream_stages(items, stages, stage_workers=None, queue_size=2, callback=None, keep_results=True):
+    """
+    Streams items through a chain of stages, each one run by its own worker threads and
+    connected to the next one by a bounded queue.
+
+    A stage can work on an item while the previous stages already work on the following items,
+    and a full queue blocks the stages feeding it, so at most `queue_size` items wait between
+    two stages.
+
+    Parameters:
+    - items: Iterable of inputs of the first stage.
+    - stages (list of (str, callable)): Name and function of every stage. Each function receives
+      the output of the previous stage.
+    - stage_workers (dict): Number of worker threads of each stage name (1 when missing).
+    - queue_size (int): Capacity of the queues between stages.
+    - callback: Optional function called with the index and the result of every finished item,
+      as soon as it leaves the last stage.
+    - keep_results (bool): Keep the results to return them. Without it, finished items are only
+      handed to the callback and can be released right away.
+
+    Returns:
+    - list: The results of the last stage in the order of the items, empty without keep_results.
+    """
+    stage_workers = stage_workers or {}
+    workers = [max(1, stage_workers.get(name, 1)) for name, _ in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    remaining = list(workers)
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+    done = object()
+
+    def put(q, item):
+        # Wait for room in the queue unless another worker failed
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return done
+
+    def close(i):
+        # The last worker of a stage tells every worker of the next stage that it is finished
+        with lock:
+            remaining[i] -= 1
+            last = remaining[i] == 0
+        if last:
+            for _ in range(workers[i + 1] if i + 1 < len(stages) else 1):
+                put(queues[i + 1], done)
+
+    def feed():
+        for index, item in enumerate(items):
+            if not put(queues[0], (index, item)):
+                return
+        for _ in range(workers[0]):
+            put(queues[0], done)
+
+    def work(i, name, func):
+        try:
+            while True:
+                item = get(queues[i])
+                if item is done:
+                    break
+                index, value = item
+                with profiling.measure(name, page=getattr(value, 'name', None)):
+                    value = func(value)
+                if not put(queues[i + 1], (index, value)):
+                    break
+        except Exception as ex:
+            errors.append(ex)
+            stop.set()
+        finally:
+            close(i)
+
+    # Workers run in a copy of the caller's context, so they record into the caller's profiler
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, (name, func) in enumerate(stages):
+        threads.extend(
+            threading.Thread(target=contextvars.copy_context().run, args=(work, i, name, func), daemon=True)
+            for _ in range(workers[i])
+        )
+    for thread in threads:
+        thread.start()
+
+    # Collect the finished items as they leave the last stage. The workers are stopped when
+    # the callback fails too
+    results = {}
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is done:
+                break
+            index, value = item
+            if keep_results:
+                results[index] = value
+            if callback is not None:
+                callback(index, value)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return [results[index] for index in sorted(results)]
+
+def run_pipeline_streaming(files, callback=None, stage_workers=None, queue_size=2, save_dir=None,
+                           keep_results=True, **options):
+    """
+    Runs the translation pipeline with every page flowing through bounded queues between the
+    stages, so different pages are segmented, translated and inpainted at the same time.
+
+    Parameters:
+    - files: Pages to translate (UploadedFile or PageFile objects).
+    - callback: Optional function called with the index and Page object of every translated
+      page as soon as it is finished.
+    - stage_workers (dict): Number of workers of each stage, see DEFAULT_STAGE_WORKERS.
+    - queue_size (int): Maximum number of pages waiting between two stages.
+    - save_dir (str): Optional directory where the intermediate results of every page are saved.
+    - keep_results (bool): Return the processed pages. Without it, pages are only handed to the
+      callback, so memory does not grow with the number of pages.
+    - options: Models and settings of the stages, see `page_stages`.
+
+    Returns:
+    - list of Page: The processed pages, empty without keep_results.
+    """
+    workers = dict(DEFAULT_STAGE_WORKERS)
+    workers.update(stage_workers or {})
+
+    def finished(index, page):
+        if save_dir is not None:
+            page.save(save_dir)
+        if callback is not None:
+            callback(index, page)
+
+    return stream_stages(files, page_stages(**options), stage_workers=workers, queue_size=queue_size,
+                         callback=finished, keep_results=keep_results)
@@ -0,0 +1,261 @@
+import io
+import csv
+import sys
+import json
+import time
+import threading
+import contextlib
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+class Profiler:
+    """
+    Collects timing events of the pipeline stages.
+
+    Every event records the wall and CPU time of a section of a stage: 'total' for the whole
+    stage, 'model' for the forward passes and 'request' for the translation calls. The time
+    spent in pre and post-processing is the total time of a stage minus its model time. Bytes
+    read and written and the peak resident memory of the process are tracked as well.
+
+    The events can be exported as JSON or CSV, or served in the Prometheus text format.
+    """
+    def __init__(self):
+        self.events = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def record(self, stage, wall, cpu=0.0, section='total', page=None, pages=1):
+        """
+        Records one timing event.
+
+        Parameters:
+        - stage (str): Pipeline stage (e.g. 'ocr').
+        - wall (float): Elapsed wall time in seconds.
+        - cpu (float): CPU time of the process in seconds.
+        - section (str): Part of the stage ('total', 'model' or 'request').
+        - page (str): Name of the page, when the event concerns a single page.
+        - pages (int): Number of pages processed during the event.
+        """
+        with self.lock:
+            self.events.append({
+                'stage': stage,
+                'section': section,
+                'page': page,
+                'pages': pages,
+                'wall': wall,
+                'cpu': cpu,
+            })
+
+    @contextlib.contextmanager
+    def measure(self, stage, section='total', page=None, pages=1):
+        """
+        Context manager recording the wall and CPU time of its body.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - wall_start, time.process_time() - cpu_start,
+                        section=section, page=page, pages=pages)
+
+    def add_bytes(self, read=0, written=0):
+        with self.lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def summary(self):
+        """
+        Aggregates the events per stage.
+
+        Returns:
+        - dict: For each stage, the pages, wall and CPU time of the whole stage, the model time,
+          the pre/post-processing time and the count, total and maximum latency of the
+          translation requests. Also the bytes read and written and the peak RSS in MB.
+        """
+        stages = {}
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            stage = stages.setdefault(event['stage'], {
+                'pages': 0, 'wall': 0.0, 'cpu': 0.0, 'model': 0.0,
+                'requests': 0, 'request_wall': 0.0, 'request_max': 0.0,
+            })
+            if event['section'] == 'total':
+                stage['pages'] += event['pages']
+                stage['wall'] += event['wall']
+                stage['cpu'] += event['cpu']
+            elif event['section'] == 'model':
+                stage['model'] += event['wall']
+            elif event['section'] == 'request':
+                stage['requests'] += 1
+                stage['request_wall'] += event['wall']
+                stage['request_max'] = max(stage['request_max'], event['wall'])
+        for stage in stages.values():
+            stage['pre_post'] = max(stage['wall'] - stage['model'], 0.0) if stage['model'] else 0.0
+        return {
+            'stages': stages,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def report(self):
+        """
+        Returns a printable table of the summary, one row per stage.
+        """
+        summary = self.summary()
+        lines = [f"{'Stage':<18}{'Pages':>7}{'Wall s':>10}{'Pages/s':>9}{'CPU s':>10}{'Model s':>10}{'Pre/post s':>12}{'Requests':>10}{'Mean req s':>12}"]
+        for name, stage in summary['stages'].items():
+            throughput = stage['pages'] / stage['wall'] if stage['wall'] > 0 else float('inf')
+            mean_request = stage['request_wall'] / stage['requests'] if stage['requests'] else 0.0
+            lines.append(f"{name:<18}{stage['pages']:>7}{stage['wall']:>10.2f}{throughput:>9.2f}{stage['cpu']:>10.2f}{stage['model']:>10.2f}"
+                         f"{stage['pre_post']:>12.2f}{stage['requests']:>10}{mean_request:>12.3f}")
+        lines.append(f"Read {summary['bytes_read'] / 1e6:.1f} MB, wrote {summary['bytes_written'] / 1e6:.1f} MB, "
+                     f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+        return '\n'.join(lines)
+
+    def to_json(self):
+        """
+        Returns the summary and every event as a JSON string.
+        """
+        with self.lock:
+            events = list(self.events)
+        return json.dumps({'summary': self.summary(), 'events': events}, indent=2)
+
+    def to_csv(self):
+        """
+        Returns every event as CSV, one row per event.
+        """
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=['stage', 'section', 'page', 'pages', 'wall', 'cpu'])
+        writer.writeheader()
+        with self.lock:
+            writer.writerows(self.events)
+        return output.getvalue()
+
+    def save(self, path):
+        """
+        Writes the profile to `path`, as CSV when it ends with .csv and as JSON otherwise.
+        """
+        with open(path, 'w', newline='') as f:
+            f.write(self.to_csv() if path.lower().endswith('.csv') else self.to_json())
+
+    def to_prometheus(self):
+        """
+        Returns the summary in the Prometheus text exposition format.
+        """
+        summary = self.summary()
+        lines = []
+        metrics = [
+            ('mangaquick_stage_pages_total', 'counter', 'Pages processed by each stage', 'pages'),
+            ('mangaquick_stage_wall_seconds_total', 'counter', 'Wall time spent in each stage', 'wall'),
+            ('mangaquick_stage_cpu_seconds_total', 'counter', 'Process CPU time spent in each stage', 'cpu'),
+            ('mangaquick_stage_model_seconds_total', 'counter', 'Wall time spent in model forward passes', 'model'),
+            ('mangaquick_stage_requests_total', 'counter', 'Translation requests sent', 'requests'),
+            ('mangaquick_stage_request_seconds_total', 'counter', 'Wall time spent waiting on translation requests', 'request_wall'),
+        ]
+        for name, kind, description, key in metrics:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for stage, values in summary['stages'].items():
+                lines.append(f'{name}{{stage="{stage}"}} {values[key]}')
+        for name, kind, description, value in [
+            ('mangaquick_bytes_read_total', 'counter', 'Bytes of page images read', summary['bytes_read']),
+            ('mangaquick_bytes_written_total', 'counter', 'Bytes of page images written', summary['bytes_written']),
+            ('mangaquick_peak_rss_megabytes', 'gauge', 'Peak resident memory of the process', summary['peak_rss_mb']),
+        ]:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """
+        Serves the metrics in the Prometheus text format at http://host:port/metrics from a
+        daemon thread.
+
+        Returns:
+        - ThreadingHTTPServer: The running server; call `shutdown` to stop it.
+        """
+        profiler = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = profiler.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of the process in MB, or 0 when it cannot be measured.
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+# Profiler receiving the events recorded by the stage functions. It is a context variable, so
+# concurrent jobs record into their own profiles; worker threads started by a job must run in
+# a copy of its context (see `contextvars.copy_context`) to record into the job's profile.
+_active = contextvars.ContextVar('profiler', default=None)
+
+@contextlib.contextmanager
+def activate(profiler):
+    """
+    Makes `profiler` receive the events recorded with `measure` and `add_bytes` within the block.
+    """
+    token = _active.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active.reset(token)
+
+def measure(stage, section='total', page=None, pages=1):
+    """
+    Measures its body with the active profiler, or does nothing when none is active.
+    """
+    profiler = _active.get()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.measure(stage, section=section, page=page, pages=pages)
+
+@contextlib.contextmanager
+def stage(profiler, name, pages=1):
+    """
+    Activates `profiler` and measures the block as the stage `name`. Does nothing when the
+    profiler is None.
+    """
+    if profiler is None:
+        yield
+        return
+    with activate(profiler), profiler.measure(name, pages=pages):
+        yield
+
+def add_bytes(read=0, written=0):
+    """
+    Counts bytes read or written with the active profiler, if any.
+    """
+    profiler = _active.get()
+    if profiler is not None:
+        profiler.add_bytes(read=read, written=written)
@@ -0,0 +1,101 @@
+import warnings
+
+import torch
+from torch import nn
+
+# Numeric precisions of the CPU inference of the segmentation and inpainting models
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+def bf16_supported():
+    """
+    Returns whether the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), without
+    which bf16 inference is emulated and slower than fp32.
+    """
+    checks = ('_is_avx512_bf16_supported', '_is_amx_tile_supported')
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+class AutocastModule(nn.Module):
+    """
+    Runs a module under CPU autocast to bfloat16 and returns its outputs as float32, so the
+    code around the module is unchanged.
+
+    When an operation of the module is not implemented for bfloat16 (e.g. the FFTs of the LaMa
+    Fourier units on some builds), the module falls back to float32 for good.
+    """
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+        self.enabled = True
+
+    def forward(self, *args, **kwargs):
+        if self.enabled:
+            try:
+                with torch.autocast('cpu', dtype=torch.bfloat16):
+                    return to_float(self.module(*args, **kwargs))
+            except RuntimeError as ex:
+                warnings.warn(f'bf16 inference is not supported by {type(self.module).__name__}, '
+                              f'it runs in fp32 from now on: {ex}', RuntimeWarning)
+                self.enabled = False
+        return self.module(*args, **kwargs)
+
+def to_float(output):
+    """
+    Casts the floating point tensors of a module output (a tensor, or a tuple, list or dict
+    of tensors) to float32.
+    """
+    if torch.is_tensor(output):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, (list, tuple)):
+        return type(output)(to_float(value) for value in output)
+    if isinstance(output, dict):
+        return {key: to_float(value) for key, value in output.items()}
+    return output
+
+def quantizable_layers(module):
+    """
+    Returns the names of the convolution and linear layers quantized by the int8 mode.
+    """
+    return [name for name, layer in module.named_modules() if type(layer) in (nn.Conv2d, nn.Linear)]
+
+def quantize_model(module, precision='fp32', keep_fp32=()):
+    """
+    Prepares a model for CPU inference at the given precision.
+
+    'int8' applies dynamic quantization to the convolution and linear layers: the weights are
+    stored as int8 and the activations are quantized on the fly with a scale computed for every
+    batch, so no calibration statistics are needed. 'bf16' runs the model under bfloat16
+    autocast. The model must be on the CPU.
+
+    Parameters:
+    - module (nn.Module): The model, in evaluation mode.
+    - precision (str): 'fp32', 'int8' or 'bf16'.
+    - keep_fp32 (iterable of str): Names of the layers (or of their parents) left in float32 in
+      int8 mode, e.g. the most sensitive layers found by quantization_check.py.
+
+    Returns:
+    - nn.Module: The model to run, the given one when the precision is 'fp32'.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}, expected one of {PRECISIONS}')
+    if precision == 'fp32':
+        return module
+    if next(module.parameters()).device.type != 'cpu':
+        raise ValueError(f'{precision} inference is only supported on CPU')
+    if precision == 'bf16':
+        return AutocastModule(module)
+
+    keep_fp32 = tuple(keep_fp32)
+    layers = {
+        name for name in quantizable_layers(module)
+        if not any(name == kept or name.startswith(f'{kept}.') for kept in keep_fp32)
+    }
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    mapping = {
+        nn.Conv2d: torch.ao.nn.quantized.dynamic.Conv2d,
+        nn.Linear: torch.ao.nn.quantized.dynamic.Linear,
+    }
+    return torch.ao.quantization.quantize_dynamic(
+        module.eval(),
+        qconfig_spec={name: qconfig for name in layers},
+        mapping=mapping,
+    )
@@ -1,4 +1,3 @@
-import os
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw
@@ -40,54 +39,169 @@ base_rect = {
     "ry": 0
 }
 
-def block_detection(file, dilation_iterations):
+# Row of the block table built by `block_table`, one row per text block:
+# - bbox: (x, y, width, height) of the block.
+# - padded: bbox grown by the OCR padding, or the bbox itself when the padding leaves the page.
+# - area: Number of mask pixels of the block.
+# - centroid: (x, y) centroid of the block.
+# - luminance: Mean luma (0.299 R + 0.587 G + 0.114 B) of the page inside the bbox.
+BLOCK_DTYPE = np.dtype([
+    ('bbox', np.int32, (4,)),
+    ('padded', np.int32, (4,)),
+    ('area', np.int32),
+    ('centroid', np.float64, (2,)),
+    ('luminance', np.float32),
+])
+
+def block_detection(page, dilation_iterations):
     """
-    Detect text blocks in an uploaded image using dilation and connected components analysis.
+    Detect text blocks in a segmented page using dilation and connected components analysis.
 
     Parameters:
-    - file: The uploaded file (UploadedFile object) to be processed.
+    - page: The Page object whose mask is processed. The mask is replaced by its dilation.
     - dilation_iterations: The number of iterations for the dilation process.
 
     Returns:
-    - output: The result of connected components analysis on the dilated image.
+    - BlockSet: The text blocks of the page.
     """
-    
-    # Extract the file name without extension
-    file_name, _ = os.path.splitext(file.name)
-
-    # Construct the path for the mask file
-    mask_path = f'prediction/segmentation/{file_name}/{file_name}_mask.png'
-
-    # Read the mask image in grayscale
-    img = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
-
     # Define the kernel size for dilation
     kernel = np.ones((5, 5), np.uint8)
 
-    # Dilate the image
-    dilated_img = cv2.dilate(img, kernel, iterations=dilation_iterations)
+    # Dilate the mask
+    dilated_img = cv2.dilate(page.mask, kernel, iterations=dilation_iterations)
 
     # Perform connected components analysis on the dilated image
     output = cv2.connectedComponentsWithStats(dilated_img, 8, cv2.CV_32S)
 
-    # Save the dilated mask image
-    cv2.imwrite(mask_path, dilated_img)
+    # Keep the dilated mask and the blocks on the page, dropping the label image
+    page.mask = dilated_img
+    page.blocks = BlockSet.from_blocks(output, page.image)
+
+    return page.blocks
+
+def block_table(blocks, image, padding=15):
+    """
+    Builds the table of the text blocks of a page, computing every per-block value used by the
+    later stages in a single vectorized pass.
+
+    Parameters:
+    - blocks: Output of connected components analysis or a list of (x, y, width, height) tuples.
+    - image: RGB (or grayscale) page array.
+    - padding (int): Padding added around the blocks cropped for OCR.
+
+    Returns:
+    - np.ndarray: Structured array of dtype BLOCK_DTYPE with one row per block.
+    """
+    if isinstance(blocks, tuple): # If blocks is a tuple, it's assumed to contain connected component analysis data
+        num_labels, _, stats, centroids = blocks
+        boxes = stats[1:num_labels, :4].astype(np.int64)
+        areas = stats[1:num_labels, cv2.CC_STAT_AREA]
+        centroids = centroids[1:num_labels]
+    else:
+        boxes = np.asarray(blocks, dtype=np.int64).reshape(-1, 4)
+        areas = boxes[:, 2] * boxes[:, 3]
+        centroids = boxes[:, :2] + boxes[:, 2:] / 2
+
+    table = np.zeros(len(boxes), dtype=BLOCK_DTYPE)
+    if len(boxes) == 0:
+        return table
+    x, y, width, height = boxes.T
+    y_len, x_len = image.shape[:2]
+
+    # Pad the blocks that stay inside the page after padding
+    fits = (y - padding > 0) & (y + height + padding <= y_len) & (x - padding > 0) & (x + width + padding <= x_len)
+    padded = boxes.copy()
+    padded[fits] += [-padding, -padding, 2 * padding, 2 * padding]
+
+    # Mean luma inside every box from a summed-area table of the page, in thousandths so the
+    # sums stay exact integers
+    luma = image.astype(np.int64) * 1000 if image.ndim == 2 else image[..., :3].astype(np.int64) @ np.array([299, 587, 114])
+    integral = np.zeros((y_len + 1, x_len + 1), dtype=np.int64)
+    integral[1:, 1:] = luma.cumsum(axis=0).cumsum(axis=1)
+    sums = (integral[y + height, x + width] - integral[y, x + width] - integral[y + height, x] + integral[y, x]) / 1000
+
+    table['bbox'] = boxes
+    table['padded'] = padded
+    table['area'] = areas
+    table['centroid'] = centroids
+    table['luminance'] = sums / np.maximum(width * height, 1)
+    return table
 
-    return output
+class BlockSet:
+    """
+    Compact set of the text blocks of a page.
+
+    Holds only the block table, so the page-sized label image of the connected components
+    analysis is released as soon as the blocks are detected. Iterating over a BlockSet yields
+    the (x, y, width, height) box of every block.
+    """
+    __slots__ = ('table',)
+
+    def __init__(self, table):
+        """
+        Parameters:
+        - table (np.ndarray): Structured array of dtype BLOCK_DTYPE (see `block_table`).
+        """
+        self.table = table
+
+    @classmethod
+    def from_blocks(cls, blocks, image, padding=15):
+        """
+        Builds a BlockSet from connected components analysis output or a list of boxes.
+        """
+        return cls(block_table(blocks, image, padding=padding))
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.boxes())
+
+    def __getstate__(self):
+        return self.table
+
+    def __setstate__(self, table):
+        self.table = table
+
+    def boxes(self):
+        """
+        Returns the (x, y, width, height) box of every block as a list of tuples of ints.
+        """
+        return [tuple(box) for box in self.table['bbox'].tolist()]
+
+    def padded_boxes(self):
+        """
+        Returns the padded box of every block, used to crop the blocks for OCR.
+        """
+        return [tuple(box) for box in self.table['padded'].tolist()]
+
+    def text_colors(self):
+        """
+        Returns the text color (0 or 255) of every block, contrasting with its background.
+        """
+        return np.where(self.table['luminance'] < 127.5, 255, 0).tolist()
 
 def blocks_to_json(blocks):
     """
     Converts block data to a JSON-compatible format using a base rectangle template.
 
     Parameters:
-    - blocks: A tuple containing the output from connected components analysis or a list of block coordinates.
+    - blocks: A BlockSet, a tuple containing the output from connected components analysis or a list of block coordinates.
 
     Returns:
     - A list of dictionaries, each representing a block's properties in JSON-compatible format.
     """
     rects = []
 
-    if isinstance(blocks, tuple): # If text_blocks is a tuple, it's assumed to contain connected component analysis data
+    if isinstance(blocks, BlockSet):
+        for x, y, width, height in blocks:
+            rect = base_rect.copy()
+            rect['left']=x
+            rect['top']=y
+            rect['width']=width
+            rect['height']=height
+            rects.append(rect)
+    elif isinstance(blocks, tuple): # If text_blocks is a tuple, it's assumed to contain connected component analysis data
         num_labels, _, stats, _ = blocks
         for i in range(1, num_labels):
             rect = base_rect.copy()
@@ -115,27 +229,17 @@ def blocks_to_json(blocks):
 
     return rects
 
-def modify_mask(file, blocks_json, canvas_json):
+def modify_mask(page, blocks_json, canvas_json):
     """
-    Modifies the mask image based on the provided canvas and blocks JSON data.
+    Modifies the mask of a page based on the provided canvas and blocks JSON data.
 
     Parameters:
-    - file: The uploaded file whose mask needs modification.
+    - page: The Page object whose mask needs modification.
     - blocks_json: JSON data representing detected blocks.
     - canvas_json: JSON data representing user-modified blocks on the canvas.
-
-    Returns:
-    - A list of blocks that were kept after modification.
     """
-    # Extract the file name without extension
-    file_name, _ = os.path.splitext(file.name)
-
-    # Construct the path for the mask file
-    mask_path = f'prediction/segmentation/{file_name}/{file_name}_mask.png'
-
-    # Read the mask image in grayscale mode
-    image = Image.open(mask_path)
-    image_copy = image.copy()
+    # Wrap the grayscale mask in a drawable image
+    image_copy = Image.fromarray(page.mask)
     image_draw = ImageDraw.Draw(image_copy)
 
     # Remove blocks that are almost identical to the ones on the canvas
@@ -151,9 +255,9 @@ def modify_mask(file, blocks_json, canvas_json):
         y = int(block['top'])
         w = int(block['width'])
         h = int(block['height'])   
-        image_draw.rectangle([(x, y), (x + w, y + h)], fill ="#000000")
+        image_draw.rectangle([(x, y), (x + w, y + h)], fill =0)
 
-    image_copy.save(mask_path, format='PNG')
+    page.mask = np.array(image_copy)
 
 def rectangles_almost_identical(blocks_json, canvas_json, i, tolerance=5):
     """
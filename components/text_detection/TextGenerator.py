@@ -25,12 +25,18 @@ class TextGenerator:
     def generate(l):
        return "".join([TextGenerator.char(random.randint(0, TextGenerator.total)) for x in range(l)])
     
+    @staticmethod
+    def text_size(font, text):
+        # FreeTypeFont.getsize was removed in Pillow 10
+        left, top, right, bottom = font.getbbox(text)
+        return right, bottom
+
     @staticmethod
     def text_wrap(text, font, max_width, max_height):
         if font.size in TextGenerator.cache:
             char_width = TextGenerator.cache[font.size]
         else:
-            char_width = TextGenerator.cache[font.size] = font.getsize('亮')[0]
+            char_width = TextGenerator.cache[font.size] = TextGenerator.text_size(font, '亮')[0]
         estimate = (max_width // char_width)
         lines = []
         i, j, hei = 0, 0, 0
@@ -38,14 +44,14 @@ class TextGenerator:
         while i < len(text) and estimate > 0:
             i = j
             j = min(len(text), i + estimate)
-            width = font.getsize(text[i:j])[0]
+            width = TextGenerator.text_size(font, text[i:j])[0]
             while j < len(text) and width <= max_width:
-                width += font.getsize(text[j])[0]
+                width += TextGenerator.text_size(font, text[j])[0]
                 j += 1
             while width > max_width and j > i:
                 j -= 1
-                width -= font.getsize(text[j])[0]
-            hei += font.getsize(text[i:j])[1]
+                width -= TextGenerator.text_size(font, text[j])[0]
+            hei += TextGenerator.text_size(font, text[i:j])[1]
             if hei > max_height or i == j:
                 break     
             if len(text[i:j]): 
@@ -91,7 +97,7 @@ class Font:
 
             for r in TextGenerator.ranges:
                 #ugly check to know if char is supported by font
-                self.chars += [chr(x) for x in range(r[0], r[1] + 1) if x in table.keys() and (glyphset[table[x]]._glyph.bytecode != b' \x1d' if hasattr(glyphset[table[x]]._glyph, 'bytecode') else glyphset[table[x]]._glyph.numberOfContours > 0)]
+                self.chars += [chr(x) for x in range(r[0], r[1] + 1) if x in table.keys() and Font.hasOutline(font, glyphset, table[x])]
              
             cache = {'ranges': str(TextGenerator.ranges), 'chars': self.chars}    
 
@@ -101,6 +107,16 @@ class Font:
         Fonts.total += len(self.chars)        
 
 
+    @staticmethod
+    def hasOutline(font, glyphset, name):
+        # Recent fontTools versions no longer expose the raw glyph on the glyph set
+        glyph = getattr(glyphset[name], '_glyph', None)
+        if glyph is None and 'glyf' in font:
+            glyph = font['glyf'][name]
+        if glyph is None:
+            return True
+        return glyph.bytecode != b' \x1d' if hasattr(glyph, 'bytecode') else glyph.numberOfContours > 0
+
     def generateText(self, length):
         return "".join(random.choice(self.chars, length))            
         
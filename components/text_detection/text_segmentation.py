@@ -1,8 +1,10 @@
 import os
 from fastai.vision import *
 from fastai import *
+import numpy as np
 import torch
-from torchvision.utils import save_image
+
+from components import profiling
 
 def comp_size(image):
     """Adjust image dimensions to even numbers.
@@ -20,38 +22,183 @@ def comp_size(image):
         hgt += 1
     return wid, hgt
 
-def text_segmentation(file, learner):
-    """Perform text segmentation on an uploaded file.
+def ceil_modulo(x, mod):
+    """Round x up to the next multiple of mod."""
+    if x % mod == 0:
+        return x
+    return (x // mod + 1) * mod
+
+def prepare_image(page):
+    """Resize a page to even dimensions and convert it to a fastai image.
 
     Args:
-        uploaded_file: The uploaded file (UploadedFile object) to be processed.
-        learner: The model used for prediction.
+        page: The Page object to be processed. Its image is replaced by the resized one,
+            since the following stages work on its coordinates.
 
-    Processes the file by resizing its dimensions to even numbers, applies
-    the model prediction, and saves the resulting mask.
+    Returns:
+        Image: The resized fastai image.
     """
-    # Extract file name
-    file_name = file.name
-    name, _ = os.path.splitext(file_name)
+    # Convert the decoded page to a fastai image
+    img = Image(pil2tensor(page.image, np.float32).div_(255))
 
-    # Construct the mask file name
-    mask_name = f'{name}_mask.png'
+    # Resize image to even number
+    wid, hgt = comp_size(img)
+    img.resize(torch.Size([img.shape[0],wid,hgt])).refresh()
 
-    # Open image
-    img = open_image(file)
+    page.image = (image2np(img.data) * 255 + 0.5).clip(0, 255).astype(np.uint8)
+    return img
 
-    # Resize image to even number   
-    wid, hgt = img.size
-    wid,hgt = comp_size(img)
-    img.resize(torch.Size([img.shape[0],wid,hgt])).refresh()
+def mask_to_array(px):
+    """Convert a predicted (1, H, W) class tensor to a 0/255 uint8 mask."""
+    return (px[0].float().clamp(0, 1) * 255 + 0.5).byte().cpu().numpy()
 
-    # Save image
-    os.makedirs(f'prediction/segmentation/{name}/', exist_ok=True)
-    img.save(f'prediction/segmentation/{name}/{name}.png')
+def text_segmentation(page, learner):
+    """Perform text segmentation on a page.
+
+    Args:
+        page: The Page object to be processed.
+        learner: The model used for prediction.
+
+    Resizes the page to even dimensions, applies the model prediction and stores the
+    resized page and the resulting mask on the page.
+    """
+    img = prepare_image(page)
 
     # Model text segmentation
     with torch.no_grad():
-        pred = learner.predict(img)[0]  
+        pred = learner.predict(img)[0]
+
+    # Store the mask as a 0/255 grayscale array
+    page.mask = mask_to_array(pred.px)
+
+def predict_batch(learner, xb):
+    """Run the learner on a batch of [0, 1] images, returning the activated predictions.
+
+    Args:
+        learner: The model used for prediction.
+        xb: Tensor of shape (N, C, H, W).
+
+    Returns:
+        Tensor: Class probabilities of shape (N, classes, H, W).
+    """
+    xb = xb.to(learner.data.device)
+    norm = getattr(learner.data, 'norm', None)
+    if norm:
+        xb, _ = norm((xb, None))
+
+    with torch.no_grad(), profiling.measure('segmentation', section='model', pages=0):
+        return learner.pred_batch(batch=(xb, torch.zeros(len(xb))))
+
+def tile_starts(length, tile_size, stride):
+    """Start offsets of the sliding windows covering `length`, the last one flush with the end."""
+    if length <= tile_size:
+        return [0]
+    count = int(np.ceil((length - tile_size) / stride)) + 1
+    return sorted({min(i * stride, length - tile_size) for i in range(count)})
+
+def blend_window(length, overlap):
+    """1D blending weights of a tile, ramping up over `overlap` pixels at both ends."""
+    ramp = np.minimum(np.arange(1, length + 1), np.arange(length, 0, -1)).astype(np.float32)
+    return np.clip(ramp / max(overlap, 1), 1e-3, 1)
+
+def text_segmentation_tiled(page, learner, tile_size=1024, overlap=128, batch_size=4):
+    """Perform text segmentation on a page with overlapping sliding-window tiles.
+
+    Args:
+        page: The Page object to be processed.
+        learner: The model used for prediction.
+        tile_size: Side of the square tiles fed to the model.
+        overlap: Pixels shared by neighbouring tiles. The predictions are blended with
+            weights ramping over the overlap so that no seams appear at tile borders.
+        batch_size: Maximum number of tiles per forward pass.
+
+    Peak activation memory depends on the tile size and batch size only, so very large
+    scans can be processed regardless of their resolution.
+    """
+    image = prepare_image(page).data
+    _, hgt, wid = image.shape
+    stride = max(tile_size - overlap, 1)
+
+    tiles = [(y, x) for y in tile_starts(hgt, tile_size, stride) for x in tile_starts(wid, tile_size, stride)]
+    tile_h, tile_w = min(tile_size, hgt), min(tile_size, wid)
+    weight = torch.from_numpy(np.outer(blend_window(tile_h, overlap), blend_window(tile_w, overlap)))
+
+    probs = None
+    weights = torch.zeros(hgt, wid)
+
+    for start in range(0, len(tiles), batch_size):
+        chunk = tiles[start:start + batch_size]
+        xb = torch.stack([image[:, y:y + tile_h, x:x + tile_w] for y, x in chunk])
+        preds = predict_batch(learner, xb).float().cpu()
+
+        # Accumulate the weighted class probabilities of every tile
+        if probs is None:
+            probs = torch.zeros(preds.shape[1], hgt, wid)
+        for j, (y, x) in enumerate(chunk):
+            probs[:, y:y + tile_h, x:x + tile_w] += preds[j] * weight
+            weights[y:y + tile_h, x:x + tile_w] += weight
+
+    pred = learner.data.single_ds.y.analyze_pred(probs / weights)
+    page.mask = mask_to_array(pred)
+
+def text_segmentation_batch(pages, learner, batch_size=4, pad_to_modulo=64, callback=None,
+                            tile_size=None, tile_overlap=128):
+    """Perform text segmentation on several pages with batched forward passes.
+
+    Args:
+        pages: The Page objects to be processed.
+        learner: The model used for prediction.
+        batch_size: Maximum number of pages per forward pass.
+        pad_to_modulo: Pages are padded with white up to a multiple of this value and
+            grouped by padded size, so pages of similar size share a batch.
+        callback: Optional function called with the number of pages processed so far.
+        tile_size: When set, pages with a side larger than this are segmented with
+            `text_segmentation_tiled` instead of being batched whole.
+        tile_overlap: Overlap between neighbouring tiles in the tiled mode.
+
+    Produces the same masks as `text_segmentation`, applying the learner normalization and
+    prediction post-processing to whole batches instead of one page at a time.
+    """
+    single_ds = learner.data.single_ds
+    done = 0
+
+    # Segment the pages too large to be processed whole tile by tile
+    images = {}
+    for i, page in enumerate(pages):
+        if tile_size and max(page.image.shape[:2]) > tile_size:
+            text_segmentation_tiled(page, learner, tile_size=tile_size, overlap=tile_overlap, batch_size=batch_size)
+            done += 1
+            if callback is not None:
+                callback(done)
+        else:
+            images[i] = prepare_image(page).data
+
+    # Group the remaining pages by padded size
+    buckets = {}
+    for i, image in images.items():
+        _, hgt, wid = image.shape
+        key = (ceil_modulo(hgt, pad_to_modulo), ceil_modulo(wid, pad_to_modulo))
+        buckets.setdefault(key, []).append(i)
+
+    for (hgt, wid), indices in buckets.items():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+
+            # Stack the pages of the chunk into a white padded batch
+            xb = torch.ones(len(chunk), images[chunk[0]].shape[0], hgt, wid)
+            for j, i in enumerate(chunk):
+                _, h, w = images[i].shape
+                xb[j, :, :h, :w] = images[i]
+
+            # Model text segmentation
+            preds = predict_batch(learner, xb)
+
+            # Scatter the masks back to their pages, removing the padding
+            for j, i in enumerate(chunk):
+                _, h, w = images[i].shape
+                pred = single_ds.y.analyze_pred(preds[j])
+                pages[i].mask = mask_to_array(pred[:, :h, :w])
 
-    # Save mask as PNG
-    save_image(pred.px, f'prediction/segmentation/{name}/{mask_name}')
\ No newline at end of file
+            done += len(chunk)
+            if callback is not None:
+                callback(done)
@@ -81,7 +81,7 @@ def textify(danImage, fonts):
                 mask = Image.new('L', bigsize, 0)
                 draw = ImageDraw.Draw(mask) 
                 draw.ellipse((0, 0) + bigsize, fill=255)
-                mask = mask.resize(im.size, Image.ANTIALIAS)
+                mask = mask.resize(im.size, Image.LANCZOS)
                 im.putalpha(mask)
 
             if rotate:
@@ -155,7 +155,8 @@ def draw_rotated_text(image, angle, text, fill, font):
     # add text to mask
     draw = ImageDraw.Draw(mask)
 
-    size = draw.multiline_textsize(text, font)
+    left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font)
+    size = (right - left, bottom - top)
     draw.multiline_text(((width - size[0]) // 2, (height - size[1]) // 2), text, 255, font, align='center')
 
     rotated_mask = rotate_image(mask, angle)
@@ -1,85 +1,162 @@
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import cv2
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
-def text_injection(file, texts, blocks, font, fontSize):
+from components import profiling
+from components.page import encode_png
+from components.text_block_detection import BlockSet
+
+def text_injection(page, font, fontSize):
     """
-    Injects text into an image at specified blocks using a given font style and size.
+    Injects the translated texts of a page into its inpainted image at the detected blocks.
     Parameters:
-    - file: The uploaded file (UploadedFile object) to be processed.
-    - texts: List of strings, where each string is the text to be injected into the corresponding block.
-    - blocks: List of tuples defining the blocks (x, y, width, height) or output from connected component analysis.
+    - page: The Page object to be processed. Its inpainted image, blocks and translations must be available.
     - font_name: Name of the font file to use for text rendering.
     - font_size: Size of the font.
     """
     # Load the font and calculate the font size
-    font_style = ImageFont.truetype(f'text_fonts/{font}', int(fontSize))
-
-    # Extract file name without extension
     font_path = f'text_fonts/{font}'
-    font_style = ImageFont.truetype(font_path, int(fontSize))
-    font_style._font_path = font_path
-
-    name, _ = os.path.splitext(file.name)
-    mask_name = f'{name}_mask.png'
-
-    # Load the image to be edited
-    image = Image.open(f'prediction/inpainting/{name}/{mask_name}')
+    font_style = load_font(font_path, int(fontSize))
 
     # Determine the color for text based on background
-    block_colors = get_block_colors(file, blocks)
+    block_colors = get_block_colors(page.image, page.blocks)
 
-    # Create a drawable image
-    image_copy = image.copy()
+    # Create a drawable image from the inpainted page
+    image_copy = Image.fromarray(page.inpainted)
     image_draw = ImageDraw.Draw(image_copy)
 
     # Inject text into the image
-    inject_text(texts, blocks, font_style, image_draw, block_colors)
+    inject_text(page.translations, page.blocks, font_style, image_draw, block_colors)
 
-    # Save image
-    os.makedirs('prediction/translated/', exist_ok=True)
-    image_copy.save(f'prediction/translated/{name}.png', format='PNG')
+    page.translated = np.array(image_copy)
 
-def get_block_colors(file, blocks):
+def text_injection_parallel(pages, font, fontSize, processes=None, output_dir=None, archive=None, callback=None):
     """
-    Determines the color for text based on the average color of the specified blocks in the image.
+    Injects the translated texts of several pages in parallel worker processes.
+
+    Every worker keeps its own font and text width caches for all the pages it renders. The
+    block colors are computed here, so only the inpainted image, the block boxes and the
+    translations of each page are sent to the workers.
+
     Parameters:
-    - file_path: File object representing the image file.
-    - blocks: List of tuples defining the blocks (x, y, width, height) or output from connected component analysis.
+    - pages (list of Page): Pages with their inpainted image, blocks and translations available.
+    - font: Name of the font file to use for text rendering.
+    - fontSize: Maximum size of the font.
+    - processes (int): Number of worker processes (defaults to the number of cores).
+    - output_dir (str): Optional directory where the workers write each translated page as a PNG file.
+    - archive (PageArchive): Optional archive receiving each translated page as soon as it is
+      finished. The workers encode the PNG files.
+    - callback: Optional function called with (done, total) every time a page is finished.
+
     Returns:
-    - A list of colors (0 or 255) where each color corresponds to a block, chosen based on the block's background color to ensure text visibility.
+    - list of Page: The same pages, in the same order, with their translated image set.
+    """
+    processes = min(processes or os.cpu_count(), len(pages))
+    if processes <= 1:
+        for i, page in enumerate(pages):
+            text_injection(page, font, fontSize)
+            if output_dir is not None:
+                page.save_translated(output_dir)
+            if archive is not None:
+                archive.add_page(page)
+            if callback is not None:
+                callback(i + 1, len(pages))
+        return pages
+
+    # Spawned workers do not inherit the CUDA context or the threads of the models
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = {}
+        for i, page in enumerate(pages):
+            future = executor.submit(
+                render_page,
+                page.inpainted,
+                block_boxes(page.blocks),
+                page.translations,
+                get_block_colors(page.image, page.blocks),
+                font,
+                fontSize,
+                None if output_dir is None else os.path.join(output_dir, f'{page.name}.png'),
+                archive is not None,
+            )
+            futures[future] = i
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            page = pages[futures[future]]
+            page.translated, data = future.result()
+            if archive is not None:
+                archive.add(f'{page.name}.png', data)
+            if output_dir is not None:
+                # The PNG file was written by the worker process
+                profiling.add_bytes(written=os.path.getsize(os.path.join(output_dir, f'{page.name}.png')))
+            if callback is not None:
+                callback(done, len(pages))
+    return pages
+
+def render_page(inpainted, boxes, translations, colors, font, fontSize, output_path=None, encode=False):
+    """
+    Renders the translations of one page into its inpainted image. Runs in a worker process.
+
+    Returns:
+    - (np.ndarray, bytes): The RGB page with the translated text injected, and its PNG encoding
+      when `encode` is set (None otherwise).
     """
-    colors = []
-    name, _ = os.path.splitext(file.name)
-    image = cv2.imread(f'prediction/segmentation/{name}/{name}.png')
-    # Iterate through blocks to determine text color
+    font_style = load_font(f'text_fonts/{font}', int(fontSize))
+    image_copy = Image.fromarray(inpainted)
+    image_draw = ImageDraw.Draw(image_copy)
+    inject_text(translations, boxes, font_style, image_draw, colors)
+    translated = np.array(image_copy)
+    data = encode_png(translated) if encode or output_path is not None else None
+    if output_path is not None:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    return translated, data if encode else None
+
+def block_boxes(blocks):
+    """
+    Returns the (x, y, width, height) box of every block, without the label image of the
+    connected component analysis output.
+    """
+    if isinstance(blocks, BlockSet):
+        return blocks.boxes()
     if isinstance(blocks, tuple):
         (num_labels, labels, stats, centroids) = blocks
-        for i in range(1, num_labels):
-            x = stats[i, cv2.CC_STAT_LEFT]
-            y = stats[i, cv2.CC_STAT_TOP]
-            width = stats[i, cv2.CC_STAT_WIDTH]
-            height = stats[i, cv2.CC_STAT_HEIGHT]
-            crop = image[y:y+height, x:x+width]
-            colors.append(255 if crop.mean(axis=(0,1))[0] < 127.5 else 0)
-    else:
-        for block in blocks:
-            x, y, width, height = block
-            crop = image[y:y+height, x:x+width]
-            colors.append(255 if crop.mean(axis=(0,1))[0] < 127.5 else 0)
-    return colors
+        return [tuple(int(v) for v in stats[i, :4]) for i in range(1, num_labels)]
+    return list(blocks)
+
+def get_block_colors(image, blocks):
+    """
+    Determines the color for text based on the mean luma of the background of the specified blocks in the image.
+    Parameters:
+    - image: RGB page array.
+    - blocks: BlockSet, list of tuples defining the blocks (x, y, width, height) or output from connected component analysis.
+    Returns:
+    - A list of colors (0 or 255) where each color corresponds to a block, chosen based on the block's background color to ensure text visibility.
+    """
+    if not isinstance(blocks, BlockSet):
+        blocks = BlockSet.from_blocks(blocks, image)
+    # The background luma of every block was computed when the blocks were detected
+    return blocks.text_colors()
 
 def inject_text(texts, blocks, font, image_draw, font_colors):
     """
     Injects the specified texts into the image at the specified blocks, using the provided font and colors.
     Parameters:
     - texts: List of strings to be injected.
-    - blocks: List of tuples (x, y, width, height) defining the blocks where texts are to be injected, or a tuple containing connected component analysis output.
+    - blocks: BlockSet, list of tuples (x, y, width, height) defining the blocks where texts are to be injected, or a tuple containing connected component analysis output.
     - font: Font object to be used for text rendering.
     - drawable_image: ImageDraw object associated with the image to draw on.
     - font_colors: List of color values (0 or 255) for each text block.
     """
     
+    if isinstance(blocks, BlockSet):
+        blocks = blocks.boxes()
+
     if isinstance(blocks, tuple):
         (num_labels, labels, stats, centroids) = blocks
         for i in range(1, num_labels):
@@ -95,7 +172,46 @@ def inject_text(texts, blocks, font, image_draw, font_colors):
             adjusted_font, lines = adjust_font_to_fit(texts[i], width, height, font)
             place_text(lines, x, y, width, height, image_draw, adjusted_font, font_colors[i])
 
+def load_font(font_path, size):
+    """
+    Returns the FreeType font of the given file and size, loading each (path, size) pair only once.
+    """
+    key = (font_path, size)
+    font = _fonts.get(key)
+    if font is None:
+        font = ImageFont.truetype(font_path, size)
+        font._font_path = font_path
+        _fonts[key] = font
+    return font
+
+def text_width(font, text):
+    """
+    Returns the rendered width of a string, memoized per font.
+    """
+    key = (getattr(font, '_font_path', None), font.size, text)
+    width = _widths.get(key)
+    if width is None:
+        bbox = font.getbbox(text)
+        width = bbox[2] - bbox[0]
+        if len(_widths) >= _MAX_CACHED_WIDTHS:
+            _widths.clear()
+        _widths[key] = width
+    return width
+
+# Fonts and string widths shared by all the blocks and pages rendered by this process
+_fonts = {}
+_widths = {}
+_MAX_CACHED_WIDTHS = 200000
+
 def adjust_font_to_fit(text, block_width, block_height, font):
+    """
+    Finds the largest font size, up to the size of `font`, at which the text wraps into the block
+    without breaking words. The size is binary-searched, as a text that fits at some size also
+    fits at every smaller one.
+    Returns:
+    - The adjusted font and the text lines. When the text does not fit even at the minimum size,
+      the minimum size is used and words are broken with hyphens.
+    """
     initial_size = font.size
     font_path = getattr(font, '_font_path', None)
     
@@ -103,16 +219,16 @@ def adjust_font_to_fit(text, block_width, block_height, font):
         words = text.split()
         if not words:
             return [""]
-        if (font.getbbox(words[0])[2] - font.getbbox(words[0])[0]) > width:
+        if text_width(font, words[0]) > width:
             return None
         lines = []
         current_line = words[0]
         for word in words[1:]:
             candidate = current_line + " " + word
-            if (font.getbbox(candidate)[2] - font.getbbox(candidate)[0]) <= width:
+            if text_width(font, candidate) <= width:
                 current_line = candidate
             else:
-                if (font.getbbox(word)[2] - font.getbbox(word)[0]) > width:
+                if text_width(font, word) > width:
                     return None
                 lines.append(current_line)
                 current_line = word
@@ -124,7 +240,7 @@ def adjust_font_to_fit(text, block_width, block_height, font):
         current = ""
         for char in text:
             test = current + char
-            if (font.getbbox(test)[2] - font.getbbox(test)[0]) <= width:
+            if text_width(font, test) <= width:
                 current = test
             else:
                 if current:
@@ -142,12 +258,12 @@ def adjust_font_to_fit(text, block_width, block_height, font):
         current_line = ""
         for word in words:
             candidate = word if not current_line else current_line + " " + word
-            if (font.getbbox(candidate)[2] - font.getbbox(candidate)[0]) <= width:
+            if text_width(font, candidate) <= width:
                 current_line = candidate
             else:
                 if current_line:
                     lines.append(current_line)
-                if (font.getbbox(word)[2] - font.getbbox(word)[0]) > width:
+                if text_width(font, word) > width:
                     broken = break_word(word, font, width)
                     lines.extend(broken)
                     current_line = ""
@@ -157,35 +273,38 @@ def adjust_font_to_fit(text, block_width, block_height, font):
             lines.append(current_line)
         return lines
 
-    best_size = None
-    best_lines = None
-    min_size = 6
-    for size in range(min_size, initial_size + 1):
-        test_font = ImageFont.truetype(font_path, size)
-        test_font._font_path = font_path
+    def fit(size):
+        # Returns the lines of the text at the given size, or None when they do not fit the block
+        test_font = load_font(font_path, size)
         lines = natural_split_no_break(text, test_font, block_width)
         if lines is None:
-            break
+            return None
         bbox = test_font.getbbox("Ay")
         line_height = bbox[3] - bbox[1]
         spacing = 0.2 * line_height
         total_height = line_height * len(lines) + spacing * (len(lines) - 1)
-        if total_height <= block_height:
+        return lines if total_height <= block_height else None
+
+    best_size = None
+    best_lines = None
+    min_size = 6
+    low, high = min_size, initial_size
+    while low <= high:
+        size = (low + high) // 2
+        lines = fit(size)
+        if lines is None:
+            high = size - 1
+        else:
             best_size = size
             best_lines = lines
-        else:
-            break
+            low = size + 1
 
     if best_size is None:
-        best_size = min_size
-        final_font = ImageFont.truetype(font_path, best_size)
-        final_font._font_path = font_path
+        final_font = load_font(font_path, min_size)
         final_lines = break_text_allowing_breaks(text, final_font, block_width)
         return final_font, final_lines
     else:
-        final_font = ImageFont.truetype(font_path, best_size)
-        final_font._font_path = font_path
-        return final_font, best_lines
+        return load_font(font_path, best_size), best_lines
 
 
 def place_text(text_lines, x, y, w, h, image_draw, font, color):
@@ -1,105 +1,168 @@
 import cv2
-import os
+import torch
 from PIL import Image
+from manga_ocr.ocr import post_process
 
-def ocr(file, text_blocks, ocr_model, ocr_type):
+from components import profiling
+from components.text_block_detection import BlockSet
+
+def ocr(page, ocr_model, ocr_type, batch_size=16, cache=None):
     """
-    Performs OCR on specified blocks of an image file using the provided OCR model.
+    Performs OCR on the text blocks of a page using the provided OCR model.
 
     Parameters:
-    - file: The uploaded file (UploadedFile object) to be processed.
-    - text_blocks: Blocks within the image to perform OCR on, defined as tuples or connected component analysis output.
+    - page: The Page object to be processed. Its blocks must have been detected.
     - ocr_model: OCR model to use for text extraction.
+    - batch_size: Maximum number of blocks recognized per forward pass.
+    - cache: Optional OcrCache with the results of previously recognized crops.
 
     Returns:
     - list of str: Extracted texts from each block.
     """
-    # Extract the base name of the file without the extension
-    name, _ = os.path.splitext(file.name)
+    return ocr_batch([page], ocr_model, ocr_type, batch_size=batch_size, cache=cache)[0]
+
+def ocr_batch(pages, ocr_model, ocr_type, batch_size=16, cache=None):
+    """
+    Performs OCR on the text blocks of several pages, recognizing the blocks of all pages
+    together so that the OCR model runs on full batches.
+
+    Parameters:
+    - pages: The Page objects to be processed. Their blocks must have been detected.
+    - ocr_model: OCR model to use for text extraction.
+    - batch_size: Maximum number of blocks recognized per forward pass.
+    - cache: Optional OcrCache with the results of previously recognized crops.
+
+    Returns:
+    - list of list of str: Extracted texts from each block of each page.
+    """
+    # Collect the crops of every page
+    crops = []
+    counts = []
+    for page in pages:
+        y_len, x_len, _ = page.image.shape
+        page_crops = block_crops(page.image, page.blocks, x_len, y_len)
+        crops.extend(page_crops)
+        counts.append(len(page_crops))
+
+    texts = recognize_crops(crops, ocr_model, ocr_type, batch_size=batch_size, cache=cache)
+
+    # Scatter the texts back to their pages in block order
+    start = 0
+    for page, count in zip(pages, counts):
+        page.texts = texts[start:start + count]
+        start += count
+
+    return [page.texts for page in pages]
+
+def block_crops(image, text_blocks, x_len, y_len):
+    """
+    Crops the specified blocks of an image, with a 15px padding when it fits in the image.
 
-    # Read the image file
-    image = cv2.imread(f'prediction/segmentation/{name}/{name}.png')
-    
-    # Get image dimensions
-    y_len, x_len, _ = image.shape
+    Parameters:
+    - image: Image array.
+    - text_blocks: Blocks within the image to crop, defined as a BlockSet, tuples or connected component analysis output.
+    - x_len, y_len: Dimensions of the image.
+
+    Returns:
+    - list of np.ndarray: The cropped blocks.
+    """
+    if isinstance(text_blocks, BlockSet):
+        # The padding rule was already applied when the blocks were detected
+        return [image[y:y+height, x:x+width].copy() for x, y, width, height in text_blocks.padded_boxes()]
+    elif isinstance(text_blocks, tuple): # If text_blocks is a tuple, it's assumed to contain connected component analysis data
+        (num_labels, labels, stats, centroids) = text_blocks
+        boxes = [(stats[i, cv2.CC_STAT_LEFT], stats[i, cv2.CC_STAT_TOP],
+                  stats[i, cv2.CC_STAT_WIDTH], stats[i, cv2.CC_STAT_HEIGHT]) for i in range(1, num_labels)]
+    else:
+        boxes = text_blocks
 
-    # Extract text from defined blocks using OCR model
-    return block_to_text(image, text_blocks, x_len, y_len, ocr_model, ocr_type)
+    crops = []
+    for x, y, width, height in boxes:
+        # Adjust block dimensions with padding if within image boundaries
+        if(y-15 > 0 and y+height+15 <= y_len and x-15 > 0 and x+width+15 <= x_len):
+            cropped = image[y-15:y+height+15, x-15:x+width+15].copy()
+        else:
+            cropped = image[y:y+height, x:x+width].copy()
+        crops.append(cropped)
+    return crops
 
-def block_to_text(image, text_blocks, x_len, y_len, ocr_model, ocr_type):
+def block_to_text(image, text_blocks, x_len, y_len, ocr_model, ocr_type, batch_size=16, cache=None):
     """
     Extracts text from specified blocks of an image using OCR.
 
     Parameters:
     - image: Image array.
-    - text_blocks: Blocks within the image to perform OCR on, defined as tuples or connected component analysis output.
+    - text_blocks: Blocks within the image to perform OCR on, defined as a BlockSet, tuples or connected component analysis output.
     - x_len, y_len: Dimensions of the image.
     - ocr_model: OCR model to use for text extraction.
+    - cache: Optional OcrCache with the results of previously recognized crops.
 
     Returns:
     - list of str: Extracted texts from each block.
     """
-    texts=[]
-    if isinstance(text_blocks, tuple): # If text_blocks is a tuple, it's assumed to contain connected component analysis data
-        (num_labels, labels, stats, centroids) = text_blocks
-        for i in range(1,num_labels):
-            x = stats[i, cv2.CC_STAT_LEFT]
-            y = stats[i, cv2.CC_STAT_TOP]
-            width = stats[i, cv2.CC_STAT_WIDTH]
-            height = stats[i, cv2.CC_STAT_HEIGHT]
-
-            # Adjust block dimensions with padding if within image boundaries
-            if(y-15 > 0 and y+height+15 <= y_len and x-15 > 0 and x+width+15 <= x_len):
-                cropped = image[y-15:y+height+15, x-15:x+width+15].copy()
-            else:
-                cropped = image[y:y+height, x:x+width].copy()
-
-            # Convert cropped array to PIL image for OCR
-            pil_image = Image.fromarray(cropped)
-            if ocr_type == 'manga_ocr':
-                text = ocr_model(pil_image)
-            elif ocr_type == 'easyocr':
-                result = ocr_model.readtext(cropped)
-                #print(result)
-                text = ' '.join([res[1] for res in result])
-            # elif ocr_type == 'PaddleOCR':
-            #     result = ocr_model.ocr(image, det=False)
-            #     print(result)
-            #     text = ' '.join([res[0][0] for res in result])
-
-
-
-            else:
-                text = ''
-            texts.append(text)
-            print(f"'{text}'")
-    else:
-        for i in range(0,len(text_blocks)):
-            x = text_blocks[i][0]
-            y = text_blocks[i][1]
-            width = text_blocks[i][2]
-            height = text_blocks[i][3]
-
-            # Adjust block dimensions with padding if within image boundarie
-            if(y-15 > 0 and y+height+15 <= y_len and x-15 > 0 and x+width+15 <= x_len):
-                cropped = image[y-15:y+height+15, x-15:x+width+15].copy()
-            else:
-                cropped = image[y:y+height, x:x+width].copy()
-
-            # Convert cropped array to PIL image for OCR
-            pil_image = Image.fromarray(cropped)
-            if ocr_type == 'manga_ocr':
-                text = ocr_model(pil_image)
-            elif ocr_type == 'easyocr':
-                result = ocr_model.readtext(cropped)
-                text = ' '.join([res[1] for res in result])
-            # elif ocr_type == 'PaddleOCR':
-            #     result = ocr_model.ocr(cropped, det=False)
-            #     print(result)
-            #     text = ' '.join([res[0][0] for res in result])
-            else:
-                text = ''
-            texts.append(text)
-            print(f"'{text}'")
-        
-    return texts
\ No newline at end of file
+    crops = block_crops(image, text_blocks, x_len, y_len)
+    return recognize_crops(crops, ocr_model, ocr_type, batch_size=batch_size, cache=cache)
+
+def recognize_crops(crops, ocr_model, ocr_type, batch_size=16, cache=None):
+    """
+    Extracts the text of a list of cropped blocks.
+
+    Parameters:
+    - crops: list of image arrays.
+    - ocr_model: OCR model to use for text extraction.
+    - ocr_type: 'manga_ocr' or 'easyocr'.
+    - batch_size: Maximum number of crops recognized per forward pass (manga_ocr only).
+    - cache: Optional OcrCache. Only the crops missing from the cache are recognized, and their
+      texts are stored.
+
+    Returns:
+    - list of str: Extracted texts from each crop.
+    """
+    if cache is not None:
+        keys = [cache.key(cropped, ocr_model, ocr_type) for cropped in crops]
+        texts = [cache.get(key) for key in keys]
+
+        missing = [i for i, text in enumerate(texts) if text is None]
+        recognized = recognize_crops([crops[i] for i in missing], ocr_model, ocr_type, batch_size=batch_size)
+        for i, text in zip(missing, recognized):
+            texts[i] = text
+            cache.put(keys[i], text)
+        return texts
+
+    if ocr_type == 'manga_ocr':
+        texts = []
+        for start in range(0, len(crops), batch_size):
+            texts.extend(manga_ocr_batch(crops[start:start + batch_size], ocr_model))
+        return texts
+    elif ocr_type == 'easyocr':
+        # easyocr runs its own detector on each crop, so crops are recognized one by one
+        with profiling.measure('ocr', section='model', pages=0):
+            return [' '.join([res[1] for res in ocr_model.readtext(cropped)]) for cropped in crops]
+    # elif ocr_type == 'PaddleOCR':
+    #     result = ocr_model.ocr(cropped, det=False)
+    #     text = ' '.join([res[0][0] for res in result])
+    return ['' for _ in crops]
+
+def manga_ocr_batch(crops, ocr_model):
+    """
+    Recognizes a batch of crops with a single generate call of the MangaOcr
+    VisionEncoderDecoder model, applying the same pre and post-processing as `MangaOcr.__call__`.
+
+    Parameters:
+    - crops: list of image arrays.
+    - ocr_model: MangaOcr instance.
+
+    Returns:
+    - list of str: Extracted texts from each crop.
+    """
+    if not crops:
+        return []
+
+    # Convert cropped arrays to grayscale PIL images for OCR
+    images = [Image.fromarray(cropped).convert('L').convert('RGB') for cropped in crops]
+    pixel_values = ocr_model.feature_extractor(images, return_tensors='pt').pixel_values
+
+    with torch.no_grad(), profiling.measure('ocr', section='model', pages=0):
+        tokens = ocr_model.model.generate(pixel_values.to(ocr_model.model.device), max_length=300).cpu()
+
+    return [post_process(text) for text in ocr_model.tokenizer.batch_decode(tokens, skip_special_tokens=True)]
@@ -1,4 +1,15 @@
-def translate_texts(text, target_language, translator):
+import time
+import asyncio
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import deepl
+import requests
+
+from components import profiling
+
+def translate_texts(text, target_language, translator, max_workers=1, retries=3, backoff=1.0, batch=False, cache=None):
     """
     Translates a list of texts into the specified target language using the provided translator.
 
@@ -6,24 +17,236 @@ def translate_texts(text, target_language, translator):
     - texts (list of str): The texts to be translated.
     - target_language (str): The target language code (e.g., 'en' for English).
     - translator: An object capable of translating text, expected to have a method `translate_text`.
+    - max_workers (int): Maximum number of translation requests in flight. With 1 the texts are
+      translated one after another, and each request sees all the previous translations as context.
+    - retries (int): Number of retries of a failed request.
+    - backoff (float): Delay in seconds before the first retry, doubled on every further retry.
+    - batch (bool): Send all the non-empty texts in a single request when the translator supports
+      it, falling back to one request per text when the batch itself fails (the response cannot
+      be split back or the request is rejected). When the service is down, the error is raised
+      instead of retrying every text on its own.
+    - cache (TranslationCache): Optional cache consulted before any request is sent. Only the
+      texts missing from the cache are translated, and their translations are stored.
 
     Returns:
     - list of str: The translated texts.
     """
+    if cache is not None:
+        return translate_texts_cached(text, target_language, translator, cache,
+                                      max_workers=max_workers, retries=retries, backoff=backoff, batch=batch)
+
+    if batch:
+        translations = translate_texts_batch(text, target_language, translator, retries, backoff)
+        if translations is not None:
+            return translations
+
+    if max_workers > 1:
+        return asyncio.run(translate_texts_concurrently(text, target_language, translator, max_workers, retries, backoff))
 
     translations = []
     for t in text:
         if t.strip() == "":
             translations.append("")
         else:
-
-            try:
-                result = translator.translate_text(t, text, translations, target_lang=target_language) 
-            except:
-                result = translator.translate_text(t, target_lang=target_language) 
-            translated_text = result.text
-            # Extracts the translated text and removes any content after '('
-            translated_text = translated_text.split('(')[0]
+            translated_text = with_retries(
+                lambda: translate_one(translator, t, text, translations, target_language),
+                retries, backoff
+            )
             translations.append(translated_text)
-        
-    return translations
\ No newline at end of file
+
+    return translations
+
+async def translate_texts_concurrently(text, target_language, translator, max_workers, retries, backoff):
+    """
+    Translates a list of texts with up to `max_workers` requests in flight, keeping the
+    results in the order of the texts.
+
+    Providers exposing an `async_translate_text` coroutine are awaited directly on the event
+    loop; the others are run in a thread pool of `max_workers` threads.
+
+    Returns:
+    - list of str: The translated texts.
+    """
+    translations = [None] * len(text)
+    semaphore = asyncio.Semaphore(max_workers)
+    loop = asyncio.get_running_loop()
+
+    def context():
+        # Translations finished so far, in order up to the first pending one
+        done = []
+        for translation in translations:
+            if translation is None:
+                break
+            done.append(translation)
+        return done
+
+    async def translate(i, t):
+        if t.strip() == "":
+            translations[i] = ""
+            return
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    if hasattr(translator, 'async_translate_text'):
+                        with profiling.measure('translation', section='request', pages=0):
+                            result = await translator.async_translate_text(t, target_language, client=client)
+                        translated_text = result.text.split('(')[0]
+                    else:
+                        translated_text = await loop.run_in_executor(
+                            executor, contextvars.copy_context().run,
+                            translate_one, translator, t, text, context(), target_language
+                        )
+                    break
+                except Exception:
+                    if attempt == retries:
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt)
+        translations[i] = translated_text
+
+    # Providers that can share a client open one for this call only, in this event loop
+    session = translator.session() if hasattr(translator, 'session') else contextlib.nullcontext()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        async with session as client:
+            await asyncio.gather(*(translate(i, t) for i, t in enumerate(text)))
+
+    return translations
+
+def translate_texts_cached(text, target_language, translator, cache, **kwargs):
+    """
+    Translates a list of texts, reusing the translations stored in the cache and translating
+    only the missing texts.
+
+    Parameters:
+    - cache (TranslationCache): The translation cache.
+    - kwargs: Further arguments of `translate_texts`.
+
+    Returns:
+    - list of str: The translated texts.
+    """
+    keys = [cache.key(translator, target_language, t, context=text) for t in text]
+    translations = [cache.get(key) if t.strip() != "" else "" for t, key in zip(text, keys)]
+
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if missing:
+        missing_translations = translate_texts([text[i] for i in missing], target_language, translator, **kwargs)
+        for i, translation in zip(missing, missing_translations):
+            translations[i] = translation
+            # An empty translation of a non-empty text is a failure, which is retried next time
+            if translation.strip() != "":
+                cache.put(keys[i], translation)
+
+    return translations
+
+def translate_texts_batch(text, target_language, translator, retries=3, backoff=1.0):
+    """
+    Translates all the non-empty texts with a single request.
+
+    DeepL translators receive the list directly; other translators must expose a
+    `translate_batch(texts, target_lang)` method returning one result per text, or None when
+    the response could not be aligned with the texts.
+
+    Only the errors of the service (see `service_error`) are retried, and they are raised once
+    the retries are exhausted, since the same requests sent one text at a time would fail too.
+
+    Returns:
+    - list of str: The translated texts, or None when batch translation is not possible.
+    """
+    indices = [i for i, t in enumerate(text) if t.strip() != ""]
+    if not indices:
+        return ["" for _ in text]
+
+    segments = [text[i] for i in indices]
+    if isinstance(translator, deepl.Translator):
+        request = lambda: translator.translate_text(segments, target_lang=target_language)
+    elif hasattr(translator, 'translate_batch'):
+        request = lambda: translator.translate_batch(segments, target_language)
+    else:
+        return None
+
+    def timed_request():
+        with profiling.measure('translation', section='request', pages=0):
+            return request()
+
+    try:
+        results = with_retries(timed_request, retries, backoff, retry_if=service_error)
+    except Exception as ex:
+        if service_error(ex):
+            raise
+        return None
+    if results is None or len(results) != len(segments):
+        return None
+
+    translations = ["" for _ in text]
+    for i, result in zip(indices, results):
+        # Extracts the translated text and removes any content after '('
+        translations[i] = result.text.split('(')[0]
+    return translations
+
+def translate_page_texts(texts, target_language, translator, pages_per_request=1, **kwargs):
+    """
+    Translates the texts of several pages, sending the texts of `pages_per_request` pages in
+    each batch request.
+
+    Parameters:
+    - texts (list of list of str): The texts of each page.
+    - pages_per_request (int): Number of pages whose texts are joined in a single request.
+    - kwargs: Further arguments of `translate_texts`.
+
+    Returns:
+    - list of list of str: The translated texts of each page.
+    """
+    translations = []
+    for start in range(0, len(texts), pages_per_request):
+        chunk = texts[start:start + pages_per_request]
+        flat = translate_texts([t for page_texts in chunk for t in page_texts], target_language, translator, **kwargs)
+
+        # Split the translations back into pages
+        offset = 0
+        for page_texts in chunk:
+            translations.append(flat[offset:offset + len(page_texts)])
+            offset += len(page_texts)
+    return translations
+
+def translate_one(translator, t, text, translations, target_language):
+    """
+    Translates a single text, passing the page texts and previous translations as context to
+    the translators that accept them.
+
+    Returns:
+    - str: The translated text.
+    """
+    with profiling.measure('translation', section='request', pages=0):
+        try:
+            result = translator.translate_text(t, text, translations, target_lang=target_language)
+        except TypeError: # Translators that take no context
+            result = translator.translate_text(t, target_lang=target_language)
+    translated_text = result.text
+    # Extracts the translated text and removes any content after '('
+    return translated_text.split('(')[0]
+
+def with_retries(func, retries, backoff, retry_if=None):
+    """
+    Calls `func`, retrying with exponential backoff when it raises an error accepted by
+    `retry_if` (any error when it is None).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as ex:
+            if attempt == retries or (retry_if is not None and not retry_if(ex)):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def service_error(ex):
+    """
+    Returns whether an error comes from the translation service being unreachable or failing
+    (connection errors, timeouts, 5xx and 429 responses, exhausted quota or a rejected key)
+    rather than from the request itself.
+    """
+    if isinstance(ex, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(ex, (deepl.ConnectionException, deepl.QuotaExceededException, deepl.TooManyRequestsException,
+                       deepl.AuthorizationException)):
+        return True
+    status = getattr(getattr(ex, 'response', None), 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
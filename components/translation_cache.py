@@ -0,0 +1,48 @@
+import hashlib
+import unicodedata
+
+from components.cache import PersistentCache
+
+class TranslationCache(PersistentCache):
+    """
+    Persistent translation cache stored in a SQLite database.
+
+    Entries are keyed by provider, model, target language and normalized source text, and
+    optionally by a hash of the page texts used as context. When the cache grows beyond
+    `max_entries`, the least recently used entries are evicted.
+    """
+    table = 'translations'
+    column = 'translation'
+
+    def __init__(self, path='cache/translations.sqlite', max_entries=100000, use_context=False):
+        """
+        Parameters:
+        - path (str): SQLite database file.
+        - max_entries (int): Maximum number of cached translations.
+        - use_context (bool): Include a hash of the page texts in the key, so the same text is
+          only reused within the same page context.
+        """
+        super().__init__(path, max_entries=max_entries)
+        self.use_context = use_context
+
+    def key(self, translator, target_language, text, context=None):
+        """
+        Builds the cache key of a text for the given translator and target language.
+        """
+        provider, model = translator_id(translator)
+        parts = [provider, model, target_language, normalize_text(text)]
+        if self.use_context and context is not None:
+            parts.append(hashlib.sha1('\n'.join(context).encode('utf-8')).hexdigest())
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def translator_id(translator):
+    """
+    Returns the (provider, model) pair identifying a translator in the cache keys.
+    """
+    return type(translator).__name__, str(getattr(translator, 'model', '') or '')
+
+def normalize_text(text):
+    """
+    Normalizes a source text so that width variants and whitespace differences share a key.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
@@ -0,0 +1,47 @@
+import os
+import uuid
+import shutil
+import weakref
+import tempfile
+
+class Workspace:
+    """
+    Private directory of a translation job.
+
+    Every job (a Streamlit session run or a CLI run) writes its files inside its own workspace
+    instead of fixed paths in the working directory, so concurrent jobs never overwrite each
+    other's files while sharing the same resident models. The directory is removed by `cleanup`,
+    and at the latest when the workspace is garbage collected (e.g. with the Streamlit session
+    holding it) or when the process exits.
+    """
+    def __init__(self, job_id=None, root=None):
+        """
+        Parameters:
+        - job_id (str): Identifier of the job, a random one by default.
+        - root (str): Directory holding the workspaces, the system temporary directory by default.
+        """
+        self.job_id = job_id or uuid.uuid4().hex
+        root = root or os.path.join(tempfile.gettempdir(), 'mangaquick')
+        self.path = os.path.join(root, self.job_id)
+        os.makedirs(self.path, exist_ok=True)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+
+    def directory(self, *parts):
+        """
+        Returns a directory inside the workspace, creating it when needed.
+        """
+        path = os.path.join(self.path, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def cleanup(self):
+        """
+        Removes the workspace and everything written in it.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
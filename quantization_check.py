@@ -0,0 +1,306 @@
+"""
+Accuracy and speed check of the quantized CPU inference modes (see components/quantization.py).
+
+Runs the text segmentation and inpainting models in fp32 and in the selected precisions over a
+small set of pages, either real pages or synthetic pages generated as in benchmark.py, and
+reports for every precision the latency, the size of the weights and the difference with the
+fp32 outputs: the IoU of the text masks and the PSNR of the inpainted text areas.
+
+With --calibrate, the int8 layers are first ranked by the error each one introduces when it is
+the only quantized layer, and the most sensitive ones are kept in float32 until the int8 model
+meets --min-mask-iou and --min-psnr. The layers to keep are written to a JSON file accepted by
+`cli.py run --quantization-config`.
+
+Example:
+    python quantization_check.py --pages-dir samples/ --precisions int8 bf16
+    python quantization_check.py --pages-dir samples/ --calibrate --output quantization.json
+"""
+# Standard library imports
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from pathlib import Path
+
+# Third-party library imports
+import numpy as np
+import torch
+
+# The text synthesis code of the segmentation training imports its modules by their bare names
+if './components/text_detection' not in sys.path:
+    sys.path.append('./components/text_detection')
+
+# Custom module imports
+from benchmark import synthetic_page, parse_size
+from TextGenerator import Fonts
+from components.page import Page
+from components.quantization import PRECISIONS, bf16_supported, quantizable_layers, quantize_model
+from components.text_detection.text_segmentation import text_segmentation_batch
+from components.text_block_detection import block_detection
+from components.image_inpainting.inpainting import DEFAULT_MODEL_PATH, InpaintingModel
+from components.pipeline import decode_page, load_pages, load_segmentation_model
+
+def load_check_pages(args):
+    """
+    Returns the first `args.pages` pages of `args.pages_dir`, or synthetic pages without it.
+    The pages are cropped to even sizes, which the segmentation would otherwise resize them to.
+    """
+    if args.pages_dir:
+        pages = [decode_page(file) for file in load_pages(args.pages_dir)[:args.pages]]
+    else:
+        fonts = Fonts(Fonts.load(Path(args.fonts_dir)))
+        width, height = args.resolution
+        pages = [synthetic_page(f'page_{i:03}.png', width, height, 6, fonts, args.seed + i, scattered_text=True)[0] for i in range(args.pages)]
+    for page in pages:
+        height, width = page.image.shape[:2]
+        page.image = np.ascontiguousarray(page.image[:height - height % 2, :width - width % 2])
+    return pages
+
+def weights_mb(module):
+    """
+    Returns the size in MB of the serialized weights of a model, including the packed int8 weights.
+    """
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+def mask_iou(mask, reference):
+    """
+    Returns the intersection over union of the text pixels of two masks, 1.0 when both are empty.
+    """
+    mask, reference = mask > 0, reference > 0
+    union = np.logical_or(mask, reference).sum()
+    return float(np.logical_and(mask, reference).sum() / union) if union else 1.0
+
+def masked_psnr(image, reference, mask):
+    """
+    Returns the PSNR in dB of an inpainted image against the reference inside the mask.
+    """
+    selected = mask > 0
+    if not selected.any():
+        return float('inf')
+    error = np.mean((image[selected].astype(np.float32) - reference[selected].astype(np.float32)) ** 2)
+    return float(10 * np.log10(255 ** 2 / error)) if error > 0 else float('inf')
+
+def segment(pages, learner):
+    """
+    Segments copies of the pages with the learner.
+
+    Returns:
+    - (list of np.ndarray, float): The masks and the mean latency per page in seconds.
+    """
+    copies = [Page(page.file_name, page.image.copy()) for page in pages]
+    start = time.perf_counter()
+    for page in copies:
+        text_segmentation_batch([page], learner, batch_size=1)
+    return [page.mask for page in copies], (time.perf_counter() - start) / len(copies)
+
+def inpaint(pages, model):
+    """
+    Inpaints the pages with the model, using the masks already on the pages.
+
+    Returns:
+    - (list of np.ndarray, float): The inpainted images and the mean latency per page in seconds.
+    """
+    start = time.perf_counter()
+    results = [model.inpaint(page.image, page.mask) for page in pages]
+    return results, (time.perf_counter() - start) / len(pages)
+
+class SegmentationCheck:
+    """
+    Runs the text segmentation model with a swappable network and scores it against fp32.
+    """
+    name = 'segmentation'
+
+    def __init__(self, args, pages):
+        self.learner = load_segmentation_model('cpu', args.model)
+        self.network = self.learner.model
+        self.pages = pages
+        self.reference, self.reference_latency = segment(pages, self.learner)
+
+    def run(self, network, pages=None):
+        """
+        Returns the mean mask IoU against fp32 and the mean latency of `network`.
+        """
+        pages = pages or self.pages
+        self.learner.model = network
+        try:
+            masks, latency = segment(pages, self.learner)
+        finally:
+            self.learner.model = self.network
+        return float(np.mean([mask_iou(mask, reference) for mask, reference in zip(masks, self.reference)])), latency
+
+class InpaintingCheck:
+    """
+    Runs the LaMa generator with a swappable network and scores it against fp32.
+    """
+    name = 'inpainting'
+
+    def __init__(self, args, pages):
+        self.model = InpaintingModel(model_path=args.inpainting_model, device='cpu')
+        self.network = self.model.model.generator
+        self.pages = pages
+        self.reference, self.reference_latency = inpaint(pages, self.model)
+
+    def run(self, network, pages=None):
+        """
+        Returns the mean PSNR of the inpainted areas against fp32 and the mean latency of `network`.
+        """
+        pages = pages or self.pages
+        self.model.model.generator = network
+        try:
+            results, latency = inpaint(pages, self.model)
+        finally:
+            self.model.model.generator = self.network
+        psnr = [masked_psnr(result, reference, page.mask) for result, reference, page in zip(results, self.reference, pages)]
+        return float(np.mean(np.minimum(psnr, 100.0))), latency
+
+def passes(check, score, args):
+    return score >= (args.min_mask_iou if check.name == 'segmentation' else args.min_psnr)
+
+@contextlib.contextmanager
+def swapped_layers(network, layers):
+    """
+    Replaces layers of a network by the given modules within the block, e.g. the fp32 layer by
+    its int8 counterpart, without copying the network.
+
+    Parameters:
+    - network (nn.Module): The network modified in place and restored on exit.
+    - layers (dict): Module replacing every layer, by layer name.
+    """
+    def replace(name, layer):
+        parent, _, child = name.rpartition('.')
+        setattr(network.get_submodule(parent) if parent else network, child, layer)
+
+    previous = {name: network.get_submodule(name) for name in layers}
+    for name, layer in layers.items():
+        replace(name, layer)
+    try:
+        yield network
+    finally:
+        for name, layer in previous.items():
+            replace(name, layer)
+
+def calibrate(check, args):
+    """
+    Chooses the layers of a model kept in float32 in int8 mode.
+
+    Every quantizable layer is quantized alone on the first `args.calibration_pages` pages to
+    rank the layers by sensitivity, then the most sensitive layers are kept in float32 one at a
+    time until the int8 model passes the accuracy threshold. The model is quantized once, and
+    the layers are swapped between the fp32 and the int8 models.
+
+    Returns:
+    - list of str: Names of the layers to keep in float32.
+    """
+    pages = check.pages[:args.calibration_pages]
+    layers = quantizable_layers(check.network)
+    quantized = quantize_model(check.network, 'int8')
+    scores = {}
+    for i, layer in enumerate(layers):
+        with swapped_layers(check.network, {layer: quantized.get_submodule(layer)}) as network:
+            scores[layer], _ = check.run(network, pages)
+        print(f'{check.name}: layer {i + 1}/{len(layers)} {layer} -> {scores[layer]:.4f}')
+    ranking = sorted(layers, key=lambda layer: scores[layer])
+
+    keep_fp32 = []
+    for count in range(0, min(len(ranking), args.max_fp32_layers) + 1, args.calibration_step):
+        keep_fp32 = ranking[:count]
+        with swapped_layers(quantized, {name: check.network.get_submodule(name) for name in keep_fp32}) as network:
+            score, _ = check.run(network, pages)
+        print(f'{check.name}: {count} layers in fp32 -> {score:.4f}')
+        if passes(check, score, args):
+            break
+    return keep_fp32
+
+def report(results):
+    """
+    Returns a printable table of the results, one row per model and precision.
+    """
+    lines = [f"{'Model':<14}{'Precision':<11}{'Latency s':>11}{'Speedup':>9}{'Weights MB':>12}{'Score':>9}{'Pass':>6}"]
+    for name, rows in results.items():
+        for row in rows:
+            lines.append(f"{name:<14}{row['precision']:<11}{row['latency']:>11.3f}{row['speedup']:>8.2f}x"
+                         f"{row['weights_mb']:>12.1f}{row['score']:>9.4f}{'yes' if row['pass'] else 'no':>6}")
+    lines.append('Score: mean mask IoU against fp32 for segmentation, mean PSNR (dB) of the inpainted areas for inpainting')
+    return '\n'.join(lines)
+
+def parse_args(argv=None):
+    """
+    Parses the command line arguments of the check.
+    """
+    parser = argparse.ArgumentParser(prog='quantization_check.py', description='Accuracy and speed of the quantized CPU inference modes')
+    parser.add_argument('--pages-dir', default=None, help='Directory or archive of pages, synthetic pages when missing')
+    parser.add_argument('--pages', type=int, default=8, help='Pages checked')
+    parser.add_argument('--resolution', type=parse_size, default=(827, 1170), metavar='WxH', help='Size of the synthetic pages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fonts-dir', default='text_fonts', help='Fonts used to draw the synthetic text')
+    parser.add_argument('--model', default=None, help='Text segmentation model file name')
+    parser.add_argument('--inpainting-model', default=DEFAULT_MODEL_PATH, help='big-lama directory')
+    parser.add_argument('--models', nargs='+', default=['segmentation', 'inpainting'], choices=('segmentation', 'inpainting'))
+    parser.add_argument('--precisions', nargs='+', default=['int8', 'bf16'], choices=PRECISIONS[1:])
+    parser.add_argument('--min-mask-iou', type=float, default=0.98, help='Minimum mean mask IoU against fp32')
+    parser.add_argument('--min-psnr', type=float, default=35.0, help='Minimum mean PSNR in dB of the inpainted areas against fp32')
+    parser.add_argument('--calibrate', action='store_true', help='Choose the int8 layers kept in fp32 to meet the thresholds')
+    parser.add_argument('--calibration-pages', type=int, default=2, help='Pages used to rank the layers by sensitivity')
+    parser.add_argument('--calibration-step', type=int, default=1, help='Layers moved to fp32 at every calibration step')
+    parser.add_argument('--max-fp32-layers', type=int, default=16, help='Maximum number of layers kept in fp32')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads used by PyTorch (defaults to all cores)')
+    parser.add_argument('--output', default=None, help='Write the results and the calibrated layers as JSON to this file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    torch.set_num_threads(args.threads or os.cpu_count())
+    if 'bf16' in args.precisions and not bf16_supported():
+        print('This CPU has no native bf16 instructions, bf16 runs emulated and is expected to be slow')
+
+    pages = load_check_pages(args)
+    if not pages:
+        print(f'No pages found in {args.pages_dir}')
+        return 1
+
+    model_dir = 'components/text_detection/models'
+    model_names = sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []
+    args.model = args.model or (model_names[0] if model_names else None)
+    if args.model is None:
+        print(f'No text segmentation model found in {model_dir}')
+        return 1
+
+    checks = []
+    if 'segmentation' in args.models:
+        checks.append(SegmentationCheck(args, pages))
+    if 'inpainting' in args.models:
+        # The inpainting is checked on the fp32 masks, dilated as in the pipeline
+        masks = checks[0].reference if checks else segment(pages, load_segmentation_model('cpu', args.model))[0]
+        for page, mask in zip(pages, masks):
+            page.mask = mask.copy()
+            block_detection(page, dilation_iterations=3)
+        checks.append(InpaintingCheck(args, pages))
+
+    results = {}
+    config = {}
+    for check in checks:
+        keep_fp32 = calibrate(check, args) if args.calibrate and 'int8' in args.precisions else []
+        config[check.name] = {'keep_fp32': keep_fp32}
+        rows = [{'precision': 'fp32', 'latency': check.reference_latency, 'speedup': 1.0,
+                 'weights_mb': weights_mb(check.network), 'score': 1.0 if check.name == 'segmentation' else 100.0, 'pass': True}]
+        for precision in args.precisions:
+            network = quantize_model(check.network, precision, keep_fp32=keep_fp32 if precision == 'int8' else ())
+            score, latency = check.run(network)
+            rows.append({'precision': precision, 'latency': latency, 'speedup': check.reference_latency / latency,
+                         'weights_mb': weights_mb(network), 'score': score, 'pass': passes(check, score, args)})
+        results[check.name] = rows
+
+    print(report(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, **config}, f, indent=2)
+        print(f'Results written to {args.output}')
+    return 0 if all(row['pass'] for rows in results.values() for row in rows) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import itertools
+import sqlite3
+
+import pytest
+
+from components import cache as cache_module
+from components.cache import PersistentCache
+from components.translation_cache import TranslationCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every timestamp of the cache one second later than the previous one.
+    """
+    ticks = itertools.count(1)
+    monkeypatch.setattr(cache_module.time, 'time', lambda: float(next(ticks)))
+
+def test_get_returns_stored_value_and_none_on_miss(tmp_path):
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'))
+    cache.put('key', 'value')
+    assert cache.get('key') == 'value'
+    assert cache.get('missing') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+
+def test_values_persist_across_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = PersistentCache(path)
+    cache.put('key', 'value')
+    cache.close()
+    assert PersistentCache(path).get('key') == 'value'
+
+def test_evicts_least_recently_used_beyond_max_entries(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = PersistentCache(path, max_entries=3)
+    for key in ('hot', 'a', 'b'):
+        cache.put(key, key)
+    # A hit served from memory must refresh the entry in the database too
+    assert cache.get('hot') == 'hot'
+    cache.put('c', 'c')
+    cache.close()
+
+    cache = PersistentCache(path, max_entries=3)
+    assert cache.get('hot') == 'hot'
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 3
+
+def test_memory_is_bounded(tmp_path):
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'), memory_entries=2)
+    for key in 'abc':
+        cache.put(key, key)
+    assert list(cache.memory) == ['b', 'c']
+    assert cache.get('a') == 'a'
+
+def test_database_uses_write_ahead_log(tmp_path):
+    cache = PersistentCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+def test_translation_cache_reads_existing_databases(tmp_path):
+    path = str(tmp_path / 'translations.sqlite')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL, last_used REAL NOT NULL)')
+    connection.execute("INSERT INTO translations VALUES ('key', 'Hello', 0)")
+    connection.commit()
+    connection.close()
+    assert TranslationCache(path).get('key') == 'Hello'
+
+def test_translation_cache_key_normalizes_text(tmp_path):
+    cache = TranslationCache(str(tmp_path / 'translations.sqlite'))
+    translator = object()
+    assert cache.key(translator, 'EN-US', 'ＡＢＣ  def') == cache.key(translator, 'EN-US', 'ABC def')
+    assert cache.key(translator, 'EN-US', 'ABC') != cache.key(translator, 'ES', 'ABC')
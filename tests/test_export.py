@@ -0,0 +1,50 @@
+import io
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from components.export import PageArchive
+from components.page import Page
+
+def translated_page(name, value):
+    page = Page(f'{name}.jpg', np.zeros((4, 6, 3), np.uint8))
+    page.translated = np.full((4, 6, 3), value, np.uint8)
+    return page
+
+def test_spooled_archive_holds_the_pages_in_order():
+    archive = PageArchive(cbz=True)
+    archive.add_page(translated_page('001', 10))
+    archive.add_page(translated_page('002', 20))
+    assert archive.file_name == 'translated.cbz'
+    assert len(archive) == 2
+
+    with zipfile.ZipFile(archive.close()) as result:
+        assert result.namelist() == ['001.png', '002.png']
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in result.infolist())
+        image = np.array(Image.open(io.BytesIO(result.read('002.png'))))
+    assert (image == 20).all()
+
+def test_repeated_names_get_a_suffix():
+    archive = PageArchive()
+    for data in (b'a', b'b', b'c'):
+        archive.add('page.png', data)
+    with zipfile.ZipFile(archive.close()) as result:
+        assert result.namelist() == ['page.png', 'page_1.png', 'page_2.png']
+        assert result.read('page_2.png') == b'c'
+
+def test_archive_written_to_a_path(tmp_path):
+    path = tmp_path / 'chapter.zip'
+    archive = PageArchive(str(path))
+    archive.add_page(translated_page('001', 0))
+    assert archive.file_name == 'chapter.zip'
+    assert archive.close() is None
+    with zipfile.ZipFile(path) as result:
+        assert result.namelist() == ['001.png']
+
+def test_spooled_archive_rolls_over_to_the_given_directory(tmp_path):
+    archive = PageArchive(max_memory=16, directory=str(tmp_path))
+    archive.add('page.png', bytes(1024))
+    assert archive.buffer._rolled
+    with zipfile.ZipFile(archive.close()) as result:
+        assert result.read('page.png') == bytes(1024)
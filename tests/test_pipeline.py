@@ -0,0 +1,91 @@
+import time
+import random
+import zipfile
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from components.pipeline import decode_page, load_pages, stream_stages
+
+def slow(func):
+    """
+    Wraps a stage function so it takes a random short time.
+    """
+    def stage(value):
+        time.sleep(random.uniform(0, 0.005))
+        return func(value)
+    return stage
+
+def wait_for_threads(count, timeout=2.0):
+    deadline = time.time() + timeout
+    while threading.active_count() > count and time.time() < deadline:
+        time.sleep(0.01)
+    return threading.active_count()
+
+def test_results_keep_the_order_of_the_items():
+    stages = [('add', slow(lambda x: x + 1)), ('double', slow(lambda x: x * 2))]
+    results = stream_stages(range(50), stages, stage_workers={'add': 3, 'double': 2})
+    assert results == [(x + 1) * 2 for x in range(50)]
+
+def test_callback_receives_every_item_once():
+    received = []
+    results = stream_stages(range(20), [('square', lambda x: x * x)], stage_workers={'square': 4},
+                            callback=lambda index, value: received.append((index, value)), keep_results=False)
+    assert results == []
+    assert sorted(received) == [(x, x * x) for x in range(20)]
+
+def test_queues_bound_the_items_in_flight():
+    pulled = []
+    in_flight = []
+
+    def items():
+        for x in range(100):
+            pulled.append(x)
+            yield x
+
+    def callback(index, value):
+        if index == 0:
+            time.sleep(0.2)
+            in_flight.append(len(pulled))
+
+    stream_stages(items(), [('a', lambda x: x), ('b', lambda x: x)], queue_size=1, callback=callback, keep_results=False)
+    # One item in each of the three queues, in each worker, the feeder and the collector
+    assert in_flight[0] <= 8
+
+def test_stage_error_is_raised_and_stops_the_workers():
+    threads = threading.active_count()
+
+    def fail(x):
+        if x == 5:
+            raise ValueError('page 5')
+        return x
+
+    with pytest.raises(ValueError, match='page 5'):
+        stream_stages(range(1000), [('fail', fail), ('b', lambda x: x)], stage_workers={'b': 2})
+    assert wait_for_threads(threads) == threads
+
+def test_callback_error_is_raised_and_stops_the_workers():
+    threads = threading.active_count()
+
+    def callback(index, value):
+        raise KeyError('output')
+
+    with pytest.raises(KeyError):
+        stream_stages(range(1000), [('a', lambda x: x), ('b', lambda x: x)], callback=callback)
+    assert wait_for_threads(threads) == threads
+
+def test_pages_are_read_lazily(tmp_path):
+    Image.fromarray(np.full((6, 8, 3), 200, np.uint8)).save(tmp_path / 'page.png')
+    with zipfile.ZipFile(tmp_path / 'chapter.cbz', 'w') as archive:
+        archive.write(tmp_path / 'page.png', 'a/page.png')
+        archive.write(tmp_path / 'page.png', 'b/page.png')
+
+    files = load_pages(str(tmp_path / 'chapter.cbz'))
+    assert [file.name for file in files] == ['page.png', 'page_1.png']
+    assert all(file.buffer is None for file in files)
+
+    pages = [decode_page(file) for file in files]
+    assert [page.image.shape for page in pages] == [(6, 8, 3), (6, 8, 3)]
+    assert all(file.buffer is None for file in files)
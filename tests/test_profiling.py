@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import threading
+import contextvars
+import urllib.request
+
+import pytest
+
+from components import profiling
+from components.profiling import Profiler
+
+def test_summary_aggregates_the_sections_of_every_stage():
+    profiler = Profiler()
+    profiler.record('ocr', 2.0, cpu=1.5, pages=2)
+    profiler.record('ocr', 1.0, cpu=0.5)
+    profiler.record('ocr', 1.2, section='model')
+    profiler.record('translation', 3.0)
+    profiler.record('translation', 0.5, section='request', pages=0)
+    profiler.record('translation', 1.5, section='request', pages=0)
+    stages = profiler.summary()['stages']
+
+    assert stages['ocr']['pages'] == 3
+    assert stages['ocr']['wall'] == pytest.approx(3.0)
+    assert stages['ocr']['cpu'] == pytest.approx(2.0)
+    assert stages['ocr']['pre_post'] == pytest.approx(1.8)
+    assert stages['translation']['requests'] == 2
+    assert stages['translation']['request_wall'] == pytest.approx(2.0)
+    assert stages['translation']['request_max'] == pytest.approx(1.5)
+
+def test_report_shows_the_throughput_of_every_stage():
+    profiler = Profiler()
+    profiler.record('inpainting', 2.0, pages=4)
+    profiler.add_bytes(read=2_000_000, written=1_000_000)
+    lines = profiler.report().splitlines()
+
+    assert 'Pages/s' in lines[0]
+    assert lines[1].split()[:4] == ['inpainting', '4', '2.00', '2.00']
+    assert lines[-1].startswith('Read 2.0 MB, wrote 1.0 MB')
+
+def test_measure_records_only_with_an_active_profiler():
+    with profiling.measure('ocr'):
+        pass
+    profiler = Profiler()
+    with profiling.activate(profiler):
+        with profiling.measure('ocr', page='page'):
+            pass
+        profiling.add_bytes(read=10)
+    with profiling.measure('ocr'):
+        pass
+
+    assert [(event['stage'], event['page']) for event in profiler.events] == [('ocr', 'page')]
+    assert profiler.bytes_read == 10
+
+def test_threads_record_into_the_profiler_of_their_context():
+    profiler = Profiler()
+
+    def work():
+        with profiling.measure('translation'):
+            pass
+
+    with profiling.activate(profiler):
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(work,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(profiler.events) == 4
+
+def test_exports():
+    profiler = Profiler()
+    profiler.record('segmentation', 1.0, cpu=0.5, page='001')
+
+    data = json.loads(profiler.to_json())
+    assert data['summary']['stages']['segmentation']['wall'] == 1.0
+    assert data['events'][0]['page'] == '001'
+
+    rows = list(csv.DictReader(io.StringIO(profiler.to_csv())))
+    assert rows == [{'stage': 'segmentation', 'section': 'total', 'page': '001', 'pages': '1', 'wall': '1.0', 'cpu': '0.5'}]
+
+    metrics = profiler.to_prometheus()
+    assert 'mangaquick_stage_wall_seconds_total{stage="segmentation"} 1.0' in metrics
+    assert '# TYPE mangaquick_peak_rss_megabytes gauge' in metrics
+
+def test_save_picks_the_format_from_the_extension(tmp_path):
+    profiler = Profiler()
+    profiler.record('ocr', 1.0)
+    profiler.save(str(tmp_path / 'profile.csv'))
+    profiler.save(str(tmp_path / 'profile.json'))
+
+    assert (tmp_path / 'profile.csv').read_text().startswith('stage,section,page,pages,wall,cpu')
+    assert 'summary' in json.loads((tmp_path / 'profile.json').read_text())
+
+def test_serve_exposes_the_metrics():
+    profiler = Profiler()
+    profiler.record('ocr', 1.0)
+    server = profiler.serve(port=0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert 'mangaquick_stage_pages_total{stage="ocr"} 1' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
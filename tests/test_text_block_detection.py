@@ -0,0 +1,50 @@
+import pickle
+
+import cv2
+import numpy as np
+
+from components.page import Page
+from components.text_block_detection import BlockSet, block_detection, block_table
+
+def test_table_of_connected_components():
+    mask = np.zeros((100, 120), np.uint8)
+    mask[20:40, 30:60] = 255
+    mask[70:80, 5:15] = 255
+    table = block_table(cv2.connectedComponentsWithStats(mask, 8, cv2.CV_32S), np.zeros((100, 120, 3), np.uint8))
+
+    assert table['bbox'].tolist() == [[30, 20, 30, 20], [5, 70, 10, 10]]
+    assert table['area'].tolist() == [600, 100]
+    assert np.allclose(table['centroid'], [[44.5, 29.5], [9.5, 74.5]])
+
+def test_padding_only_inside_the_page():
+    table = block_table([(30, 30, 10, 10), (5, 5, 10, 10)], np.zeros((100, 100, 3), np.uint8), padding=15)
+    assert table['padded'].tolist() == [[15, 15, 40, 40], [5, 5, 10, 10]]
+
+def test_text_color_contrasts_with_the_luma_of_the_background():
+    image = np.zeros((50, 150, 3), np.uint8)
+    image[:, :50] = (255, 255, 255) # White: black text
+    image[:, 50:100] = (255, 0, 0) # Red, dark in luma although its first channel is 255: white text
+    image[:, 100:] = (0, 255, 0) # Green, bright in luma although its first channel is 0: black text
+    blocks = BlockSet.from_blocks([(0, 0, 50, 50), (50, 0, 50, 50), (100, 0, 50, 50)], image)
+
+    assert np.allclose(blocks.table['luminance'], [255, 0.299 * 255, 0.587 * 255], atol=0.01)
+    assert blocks.text_colors() == [0, 255, 0]
+
+def test_luma_of_grayscale_pages():
+    image = np.full((20, 20), 100, np.uint8)
+    assert np.allclose(block_table([(0, 0, 20, 20)], image)['luminance'], [100])
+
+def test_empty_table():
+    assert len(block_table([], np.zeros((10, 10, 3), np.uint8))) == 0
+
+def test_block_detection_keeps_only_the_table():
+    page = Page('page.png', np.full((60, 60, 3), 255, np.uint8))
+    page.mask = np.zeros((60, 60), np.uint8)
+    page.mask[10:20, 10:20] = 255
+    page.mask[22:30, 10:20] = 255
+    blocks = block_detection(page, dilation_iterations=1)
+
+    # The dilation joins the two components into one block
+    assert blocks.boxes() == [(8, 8, 14, 24)]
+    assert blocks.padded_boxes() == blocks.boxes()
+    assert pickle.loads(pickle.dumps(blocks)).boxes() == blocks.boxes()
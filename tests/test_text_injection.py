@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from components.text_injection import adjust_font_to_fit, load_font, text_width
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'text_fonts', 'Anime Ace v3.ttf')
+
+@pytest.mark.parametrize('text, width, height', [
+    ('Hello there', 200, 100),
+    ('What are you doing here at this hour of the night?', 120, 160),
+    ('A', 30, 30),
+])
+def test_fitted_size_is_the_largest_that_fits(text, width, height):
+    font, lines = adjust_font_to_fit(text, width, height, load_font(FONT_PATH, 40))
+
+    assert ' '.join(lines) == text
+    assert all(text_width(font, line) <= width for line in lines)
+    if font.size < 40:
+        # One size larger does not fit, so the search stops at the same size
+        larger, _ = adjust_font_to_fit(text, width, height, load_font(FONT_PATH, font.size + 1))
+        assert larger.size == font.size
+
+def test_words_are_broken_at_the_minimum_size():
+    font, lines = adjust_font_to_fit('Incomprehensibilities', 30, 200, load_font(FONT_PATH, 20))
+
+    assert font.size == 6
+    assert len(lines) > 1
+    assert all(line.endswith('-') for line in lines[:-1])
+    assert ''.join(line.rstrip('-') for line in lines) == 'Incomprehensibilities'
+
+def test_fonts_are_loaded_once_per_size():
+    assert load_font(FONT_PATH, 12) is load_font(FONT_PATH, 12)
+    assert load_font(FONT_PATH, 12) is not load_font(FONT_PATH, 13)
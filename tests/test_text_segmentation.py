@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from components.text_detection.text_segmentation import blend_window, tile_starts
+
+@pytest.mark.parametrize('length, tile_size, overlap', [(1000, 1000, 128), (1500, 1024, 128), (3000, 512, 64), (700, 256, 200)])
+def test_tiles_cover_the_length_with_the_overlap(length, tile_size, overlap):
+    starts = tile_starts(length, tile_size, tile_size - overlap)
+
+    assert starts[0] == 0
+    assert starts[-1] == max(length - tile_size, 0)
+    # Consecutive tiles overlap by at least `overlap` pixels, so there are no gaps
+    assert all(0 < b - a <= tile_size - overlap for a, b in zip(starts, starts[1:]))
+
+def test_short_lengths_are_a_single_tile():
+    assert tile_starts(300, 512, 384) == [0]
+
+def test_blend_window_ramps_over_the_overlap():
+    window = blend_window(10, 4)
+
+    assert np.allclose(window, [0.25, 0.5, 0.75, 1, 1, 1, 1, 0.75, 0.5, 0.25])
+    assert (blend_window(5, 0) > 0).all()
+
+def test_blended_tiles_reproduce_a_seamless_prediction():
+    # Blending tiles of a smooth prediction with the normalized weights gives the prediction back
+    length, tile_size, overlap = 1100, 512, 128
+    prediction = np.sin(np.linspace(0, 6, length))
+    weight = blend_window(tile_size, overlap)
+    total = np.zeros(length)
+    weights = np.zeros(length)
+    for start in tile_starts(length, tile_size, tile_size - overlap):
+        total[start:start + tile_size] += prediction[start:start + tile_size] * weight
+        weights[start:start + tile_size] += weight
+
+    assert (weights > 0).all()
+    assert np.allclose(total / weights, prediction)